@@ -4,11 +4,14 @@ from pathlib import Path
 from typing import Optional
 from sqlmodel import Session, select
 from dotenv import load_dotenv
-from livekit import api
 from livekit.api import AccessToken, VideoGrants
 import json
-from .db import engine, HelpRequest, KBEntry
+from .db import engine, HelpRequest, KBEntry, DEFAULT_TENANT
 from .notifications import notify_supervisor
+from .livekit_client import LiveKitClient
+from . import analytics, cluster
+from .tenants import get_kb_index
+from .tracing import traced
 
 # --- Load environment variables ---
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -21,38 +24,24 @@ LIVEKIT_URL = os.getenv("LIVEKIT_URL")
 if not all([LIVEKIT_API_KEY, LIVEKIT_API_SECRET, LIVEKIT_URL]):
     raise ValueError("LiveKit environment variables not set properly")
 
-lkapi = api.LiveKitAPI(
-    url=LIVEKIT_URL,
-    api_key=LIVEKIT_API_KEY,
-    api_secret=LIVEKIT_API_SECRET
-)
+livekit = LiveKitClient(LIVEKIT_URL, LIVEKIT_API_KEY, LIVEKIT_API_SECRET)
 
 
 # --- LiveKit room creation ---
+@traced("create_livekit_room")
 async def create_livekit_room(room_name: str) -> str:
     """
     Creates a LiveKit room and returns the room name (URL-friendly).
-    This is idempotent: if the room exists, LiveKit will continue without error.
+    An already existing room is treated as success; timeouts, LiveKit errors and
+    an open circuit breaker raise LiveKitUnavailable.
     """
-    try:
-        # Use CreateRoomRequest instead of RoomCreateOptions
-        room = await lkapi.room.create_room(
-            api.CreateRoomRequest(
-                name=room_name,
-                empty_timeout=600,
-            )
-        )
-        created_name = room.name
-        print(f"[LiveKit] Room created: {created_name}")
-    except Exception as exc:
-        # Room might already exist
-        print(f"[LiveKit] create_room warning: {exc}")
-        created_name = room_name
-
+    created_name = await livekit.create_room(room_name)
+    print(f"[LiveKit] Room created: {created_name}")
     return created_name
 
 
 # --- Generate access token ---
+@traced("generate_access_token")
 def generate_access_token(identity: str, room_name: str, role: str = "caller") -> str:
     """
     Generate a LiveKit join token (JWT) for a participant identity and room.
@@ -95,27 +84,41 @@ def generate_access_token(identity: str, room_name: str, role: str = "caller") -
 
 
 # --- KB lookup ---
-def find_in_kb(question: str) -> Optional[KBEntry]:
-    with Session(engine) as session:
-        stmt = select(KBEntry)
-        for r in session.exec(stmt):
-            if r.question.strip().lower() in question.lower():
-                return r
-    return None
+@traced("find_in_kb")
+def find_in_kb(question: str, tenant_id: str = DEFAULT_TENANT) -> Optional[KBEntry]:
+    return get_kb_index(tenant_id).match(question)
 
 
 # --- Create help request ---
-def create_help_request(caller: str, question: str) -> HelpRequest:
-    hr = HelpRequest(caller=caller, question=question)
+@traced("create_help_request")
+def create_help_request(caller: str, question: str, tenant_id: str = DEFAULT_TENANT) -> HelpRequest:
+    hr = HelpRequest(caller=caller, question=question, tenant_id=tenant_id)
     with Session(engine) as session:
         session.add(hr)
         session.commit()
         session.refresh(hr)
 
     notify_supervisor(hr)
+    cluster.ticket_created(hr)
+    analytics.record_escalation(hr.question, hr.created_at)
     return hr
 
 
+# --- Store room on ticket ---
+@traced("store_room_name")
+def store_room_name(ticket_id: str, room_name: str):
+    """Record the ticket's LiveKit room (the escalation's second DB write) and signal that it's ready."""
+    with Session(engine) as session:
+        hr = session.exec(
+            select(HelpRequest).where(HelpRequest.ticket_id == ticket_id)
+        ).first()
+        if hr:
+            hr.room_url = room_name  # Store room name, not full URL
+            session.add(hr)
+            session.commit()
+    cluster.room_ready(ticket_id, room_name)
+
+
 # --- Spawn room for ticket ---
 async def spawn_room_for_ticket(ticket_id: str):
     """Helper coroutine to create and store LiveKit room name into the DB."""
@@ -124,15 +127,7 @@ async def spawn_room_for_ticket(ticket_id: str):
         # Small delay to ensure DB transaction is committed
         await asyncio.sleep(0.5)
         created_name = await create_livekit_room(room_name)
-        
-        with Session(engine) as session:
-            hr = session.exec(
-                select(HelpRequest).where(HelpRequest.ticket_id == ticket_id)
-            ).first()
-            if hr:
-                hr.room_url = created_name  # Store room name, not full URL
-                session.add(hr)
-                session.commit()
-                print(f"[DB] Updated ticket {ticket_id} with room: {created_name}")
+        store_room_name(ticket_id, created_name)
+        print(f"[DB] Updated ticket {ticket_id} with room: {created_name}")
     except Exception as e:
         print(f"[ERROR] Failed to spawn room for ticket {ticket_id}: {e}")
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Incrementally maintained analytics for the helpdesk.
+Counters are bumped as events happen (KB lookup, ticket created, resolved,
+timed out) into hourly and daily buckets, so /admin/stats never scans
+HelpRequest. Unanswered questions are tracked with a Space-Saving
+heavy-hitters sketch of fixed size.
+In a cluster each node also accumulates the deltas it recorded and the
+cluster module publishes them about once a second (see cluster.py), so every
+node's counters cover the whole cluster while the per-node cost of keeping
+up stays independent of total traffic.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+HOURLY_BUCKETS_KEPT = 48
+DAILY_BUCKETS_KEPT = 90
+TOP_QUESTIONS_CAPACITY = 100  # Sketch size; top-N lists are drawn from this
+TOP_QUESTIONS_SHOWN = 10
+
+COUNTER_NAMES = ("kb_hits", "kb_misses", "escalations", "resolved", "timeouts", "resolve_seconds")
+
+# Event kinds (also the wire format between nodes)
+KB_LOOKUP = "kb_lookup"
+ESCALATION = "escalation"
+RESOLVED = "resolved"
+TIMEOUT = "timeout"
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters sketch (Metwally et al.).
+    Tracks at most `capacity` items; any item whose true count exceeds
+    total/capacity is guaranteed to be present, and its count is overestimated
+    by at most the recorded error.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: dict[str, list[int]] = {}  # item -> [count, error]
+
+    def add(self, item: str, count: int = 1):
+        entry = self.counts.get(item)
+        if entry:
+            entry[0] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = [count, 0]
+        else:
+            victim = min(self.counts, key=lambda k: self.counts[k][0])
+            floor = self.counts.pop(victim)[0]
+            self.counts[item] = [floor + count, floor]
+
+    def top(self, n: int) -> list[dict]:
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+        return [{"question": item, "count": c, "max_overcount": err} for item, (c, err) in ranked]
+
+
+_lock = threading.Lock()
+_totals = dict.fromkeys(COUNTER_NAMES, 0)
+_hourly: dict[datetime, dict] = {}
+_daily: dict[datetime, dict] = {}
+_unanswered = SpaceSaving(TOP_QUESTIONS_CAPACITY)
+# Deltas recorded here but not yet published to the other nodes (cluster mode only)
+_sharing = False
+_unsent_counters: dict[datetime, dict[str, float]] = {}  # hour -> counter -> amount
+_unsent_questions: dict[str, int] = {}
+
+
+def _bump(at: datetime, name: str, amount: float = 1, total: bool = True):
+    """Add to the total (unless total=False) and to the hour/day buckets containing `at` (call with _lock held)."""
+    if total:
+        _totals[name] += amount
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    for buckets, key, kept, step in (
+        (_hourly, hour, HOURLY_BUCKETS_KEPT, timedelta(hours=1)),
+        (_daily, day, DAILY_BUCKETS_KEPT, timedelta(days=1)),
+    ):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = dict.fromkeys(COUNTER_NAMES, 0)
+            oldest = key - kept * step
+            for stale in [k for k in buckets if k <= oldest]:
+                del buckets[stale]
+        bucket[name] += amount
+
+
+def _normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _deltas(kind: str, fields: dict) -> list[tuple[str, float]]:
+    if kind == KB_LOOKUP:
+        return [("kb_hits" if fields["hit"] else "kb_misses", 1)]
+    if kind == ESCALATION:
+        return [("escalations", 1)]
+    if kind == RESOLVED:
+        return [("resolved", 1), ("resolve_seconds", fields["seconds"])]
+    if kind == TIMEOUT:
+        return [("timeouts", 1)]
+    return []
+
+
+def _apply(kind: str, at: datetime, fields: dict, total: bool = True) -> list[tuple[str, float]]:
+    """Fold one event into the counters (call with _lock held). Returns the counter deltas."""
+    deltas = _deltas(kind, fields)
+    for name, amount in deltas:
+        _bump(at, name, amount, total)
+    if kind == ESCALATION:
+        _unanswered.add(_normalize(fields["question"]))
+    return deltas
+
+
+def _record(kind: str, at: datetime, **fields):
+    with _lock:
+        deltas = _apply(kind, at, fields)
+        if _sharing:
+            unsent = _unsent_counters.setdefault(at.replace(minute=0, second=0, microsecond=0), {})
+            for name, amount in deltas:
+                unsent[name] = unsent.get(name, 0) + amount
+            if kind == ESCALATION:
+                question = _normalize(fields["question"])
+                _unsent_questions[question] = _unsent_questions.get(question, 0) + 1
+
+
+# --- Event hooks ---
+def record_kb_lookup(hit: bool, at: Optional[datetime] = None):
+    _record(KB_LOOKUP, at or datetime.utcnow(), hit=hit)
+
+
+def record_escalation(question: str, at: Optional[datetime] = None):
+    _record(ESCALATION, at or datetime.utcnow(), question=question)
+
+
+def record_resolved(created_at: datetime, resolved_at: datetime):
+    _record(RESOLVED, resolved_at, seconds=(resolved_at - created_at).total_seconds())
+
+
+def record_timeout(at: Optional[datetime] = None):
+    _record(TIMEOUT, at or datetime.utcnow())
+
+
+def configure_cluster():
+    """Start accumulating local deltas for take_unsent()."""
+    global _sharing
+    _sharing = True
+
+
+def take_unsent() -> Optional[dict]:
+    """Counter and question deltas recorded here since the last call, or None if nothing happened."""
+    with _lock:
+        if not _unsent_counters and not _unsent_questions:
+            return None
+        delta = {
+            "counters": {hour.isoformat(): counters for hour, counters in _unsent_counters.items()},
+            "questions": dict(_unsent_questions),
+        }
+        _unsent_counters.clear()
+        _unsent_questions.clear()
+    return delta
+
+
+def apply_remote(delta: dict):
+    """Add a delta published by another node (see take_unsent)."""
+    with _lock:
+        for hour, counters in delta["counters"].items():
+            at = datetime.fromisoformat(hour)
+            for name, amount in counters.items():
+                if name in COUNTER_NAMES:
+                    _bump(at, name, amount)
+        for question, count in delta["questions"].items():
+            _unanswered.add(question, count)
+
+
+def _ticket_events(question: str, created_at: datetime, state: str, resolved_at: Optional[datetime]):
+    """The (kind, at, fields) events a stored ticket stands for."""
+    yield ESCALATION, created_at, {"question": question}
+    if state == "RESOLVED" and resolved_at:
+        yield RESOLVED, resolved_at, {"seconds": (resolved_at - created_at).total_seconds()}
+    elif state == "UNRESOLVED":
+        yield TIMEOUT, resolved_at or created_at, {}
+
+
+def ticket_totals(rows) -> dict[str, float]:
+    """Counter totals for (question, created_at, state, resolved_at) rows, e.g. for the archive rollup."""
+    totals = dict.fromkeys(COUNTER_NAMES, 0)
+    for row in rows:
+        for kind, _, fields in _ticket_events(*row):
+            for name, amount in _deltas(kind, fields):
+                totals[name] += amount
+    return totals
+
+
+def load_history(rows, count_totals: bool = True):
+    """
+    Seed ticket counters at startup from (question, created_at, state, resolved_at)
+    rows: recent archive partitions first (oldest), then the live table. Every
+    node reads the same rows, so history is not published. KB hits are not
+    stored anywhere, so those start from zero. With count_totals=False only the
+    buckets and the sketch are filled; the all-time totals for those rows come
+    from load_totals() instead.
+    """
+    with _lock:
+        for row in rows:
+            for kind, at, fields in _ticket_events(*row):
+                _apply(kind, at, fields, count_totals)
+
+
+def load_totals(totals: dict):
+    """Add persisted all-time totals (see ticket_totals) without touching the buckets."""
+    with _lock:
+        for name in COUNTER_NAMES:
+            _totals[name] += totals.get(name, 0)
+
+
+# --- Read side ---
+def _rates(counters: dict) -> dict:
+    lookups = counters["kb_hits"] + counters["kb_misses"]
+    closed = counters["resolved"] + counters["timeouts"]
+    return {
+        **{name: counters[name] for name in COUNTER_NAMES if name != "resolve_seconds"},
+        "kb_hit_ratio": round(counters["kb_hits"] / lookups, 4) if lookups else None,
+        "timeout_rate": round(counters["timeouts"] / closed, 4) if closed else None,
+        "avg_resolve_seconds": (
+            round(counters["resolve_seconds"] / counters["resolved"], 1) if counters["resolved"] else None
+        ),
+    }
+
+
+def stats() -> dict:
+    """Totals, hourly/daily series and top unanswered questions."""
+    with _lock:
+        return {
+            "totals": _rates(_totals),
+            "hourly": {k.isoformat(): _rates(v) for k, v in sorted(_hourly.items())},
+            "daily": {k.date().isoformat(): _rates(v) for k, v in sorted(_daily.items())},
+            "top_unanswered": _unanswered.top(TOP_QUESTIONS_SHOWN),
+        }
@@ -0,0 +1,210 @@
+"""
+Retention and archival for closed help requests.
+RESOLVED/UNRESOLVED tickets older than ARCHIVE_AFTER_DAYS are moved out of the
+live table into gzip-compressed JSONL files partitioned by creation date:
+
+    <ARCHIVE_DIR>/date=YYYY-MM-DD/part-<unix_ms>-<n>.jsonl.gz
+
+ARCHIVE_DIR defaults to archive/help_requests next to the app package and
+can be overridden with the ARCHIVE_DIR environment variable. In cluster mode
+only the leader archives, but every node serves /admin/archive and seeds
+analytics from the archive, so it must point at storage all nodes share.
+
+Rows are moved in batches: each batch is written to disk first and only then
+deleted from the DB, so a crash can at worst leave a duplicate on disk.
+A ticket always lands in its creation-date partition, so the query path
+de-duplicates by ticket_id within each partition.
+
+rollup.json next to the partitions keeps the analytics totals of everything
+archived so far, updated with each batch. Startup seeds all-time totals from
+it and only decompresses the partitions still inside the analytics window.
+A crash between the rollup update and the DB delete can count a batch twice.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+from sqlalchemy import delete, or_, and_
+from sqlmodel import Session, select
+from . import analytics
+from .db import HelpRequest, engine, DEFAULT_TENANT
+
+ARCHIVE_DIR = Path(
+    os.getenv("ARCHIVE_DIR") or Path(__file__).resolve().parent.parent / "archive" / "help_requests"
+)
+ROLLUP_FILE = ARCHIVE_DIR / "rollup.json"
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 500
+
+ARCHIVE_FIELDS = (
+    "ticket_id", "tenant_id", "caller", "question", "created_at",
+    "state", "supervisor_answer", "resolved_at", "room_url",
+)
+
+
+def _to_record(hr: HelpRequest) -> dict:
+    record = {}
+    for field in ARCHIVE_FIELDS:
+        value = getattr(hr, field)
+        record[field] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+
+def _write_partition(day: date, records: list[dict], seq: int):
+    partition = ARCHIVE_DIR / f"date={day.isoformat()}"
+    partition.mkdir(parents=True, exist_ok=True)
+    final = partition / f"part-{int(time.time() * 1000)}-{seq}.jsonl.gz"
+    tmp = final.with_suffix(".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    tmp.replace(final)  # Readers never see half-written parts
+
+
+def _write_rollup(totals: dict):
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = ROLLUP_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(totals), encoding="utf-8")
+    tmp.replace(ROLLUP_FILE)
+
+
+def _history_row(record: dict) -> tuple:
+    resolved_at = record["resolved_at"]
+    return (
+        record["question"],
+        datetime.fromisoformat(record["created_at"]),
+        record["state"],
+        datetime.fromisoformat(resolved_at) if resolved_at else None,
+    )
+
+
+def archived_totals() -> dict:
+    """
+    All-time analytics totals of archived tickets, for analytics.load_totals.
+    An archive written before the rollup existed is scanned once to build it.
+    """
+    if ROLLUP_FILE.exists():
+        return json.loads(ROLLUP_FILE.read_text(encoding="utf-8"))
+    totals = analytics.ticket_totals(_history_row(record) for record in query_archive())
+    if any(totals.values()):
+        _write_rollup(totals)
+    return totals
+
+
+def archive_closed_requests(older_than_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """
+    Move closed tickets older than the cutoff into the archive.
+    Returns the number of rows archived.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    seq = 0
+    rollup = None
+
+    while True:
+        with Session(engine) as session:
+            batch = session.exec(
+                select(HelpRequest)
+                .where(HelpRequest.state != "PENDING")
+                .where(or_(
+                    HelpRequest.resolved_at < cutoff,
+                    and_(HelpRequest.resolved_at.is_(None), HelpRequest.created_at < cutoff),
+                ))
+                .order_by(HelpRequest.id)
+                .limit(ARCHIVE_BATCH_SIZE)
+            ).all()
+            if not batch:
+                break
+
+            by_day: dict[date, list[dict]] = {}
+            for hr in batch:
+                by_day.setdefault(hr.created_at.date(), []).append(_to_record(hr))
+            if rollup is None:
+                rollup = archived_totals()  # Before writing, so a first-time backfill doesn't see this batch
+            for day, records in by_day.items():
+                seq += 1
+                _write_partition(day, records, seq)
+            batch_totals = analytics.ticket_totals(
+                (hr.question, hr.created_at, hr.state, hr.resolved_at) for hr in batch
+            )
+            rollup = {name: rollup.get(name, 0) + amount for name, amount in batch_totals.items()}
+            _write_rollup(rollup)
+
+            session.execute(delete(HelpRequest).where(HelpRequest.id.in_([hr.id for hr in batch])))
+            session.commit()
+            archived += len(batch)
+
+        if len(batch) < ARCHIVE_BATCH_SIZE:
+            break
+
+    if archived:
+        print(f"[Archive] Moved {archived} closed ticket(s) older than {older_than_days}d to {ARCHIVE_DIR}")
+    return archived
+
+
+def _partitions(start: Optional[date], end: Optional[date]) -> Iterator[Path]:
+    if not ARCHIVE_DIR.exists():
+        return
+    for partition in sorted(ARCHIVE_DIR.glob("date=*")):
+        try:
+            day = date.fromisoformat(partition.name[len("date="):])
+        except ValueError:
+            continue
+        if (start and day < start) or (end and day > end):
+            continue
+        yield partition
+
+
+def query_archive(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    state: Optional[str] = None,
+    tenant_id: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Stream archived tickets created between start and end (inclusive).
+    Only the partitions in range are opened, one line at a time.
+    """
+    for partition in _partitions(start, end):
+        seen: set[str] = set()  # Duplicates share a partition; memory stays per-day
+        for part in sorted(partition.glob("part-*.jsonl.gz")):
+            with gzip.open(part, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["ticket_id"] in seen:
+                        continue
+                    seen.add(record["ticket_id"])
+                    if state and record["state"] != state:
+                        continue
+                    if tenant_id and record.get("tenant_id", DEFAULT_TENANT) != tenant_id:
+                        continue
+                    yield record
+
+
+def archived_history(since: Optional[date] = None) -> Iterator[tuple]:
+    """(question, created_at, state, resolved_at) for tickets archived from `since` on, for analytics.load_history."""
+    for record in query_archive(start=since):
+        yield _history_row(record)
+
+
+def archive_report(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 100,
+    tenant_id: Optional[str] = None,
+) -> dict:
+    """Per-day and per-state counts over the archive, plus the first `limit` rows."""
+    by_day: dict[str, dict[str, int]] = {}
+    rows = []
+    total = 0
+    for record in query_archive(start, end, tenant_id=tenant_id):
+        total += 1
+        day = record["created_at"][:10]
+        counts = by_day.setdefault(day, {})
+        counts[record["state"]] = counts.get(record["state"], 0) + 1
+        if len(rows) < limit:
+            rows.append(record)
+    return {"total": total, "by_day": by_day, "rows": rows}
@@ -4,13 +4,52 @@ Background worker for handling timeouts and cleanup tasks.
 import threading
 import time
 from datetime import datetime, timedelta
+from typing import Optional
 from sqlmodel import Session, select
 from .db import HelpRequest, engine
 from .notifications import notify_caller_followup
+from . import analytics, cluster, pending_store
+from .pending_store import PendingTicket
+from .archive import archive_closed_requests
+from .rooms import release_room
 
 # Timeout settings
 SUPERVISOR_TIMEOUT_SECONDS = 300  # 5 minutes
 CHECK_INTERVAL_SECONDS = 30  # Check every 30 seconds
+ARCHIVE_INTERVAL_SECONDS = 3600  # Move old closed tickets to the archive hourly
+SWEEP_BATCH_SIZE = 500  # Ticket ids per IN (...) query; well under SQLite's bound-variable limit
+
+
+def load_expired(session: Session, cutoff: datetime) -> tuple[list[HelpRequest], list[PendingTicket]]:
+    """
+    Tickets created before cutoff, found through the age-ordered pending store
+    and reloaded from the DB in batches. Returns the rows still PENDING, and the
+    store entries whose ticket was closed by another path since the store was read.
+    """
+    expired = pending_store.older_than(cutoff)
+    rows = {}
+    for start in range(0, len(expired), SWEEP_BATCH_SIZE):
+        ticket_ids = [ticket.ticket_id for ticket in expired[start:start + SWEEP_BATCH_SIZE]]
+        for hr in session.exec(select(HelpRequest).where(HelpRequest.ticket_id.in_(ticket_ids))):
+            rows[hr.ticket_id] = hr
+
+    pending, closed = [], []
+    for ticket in expired:
+        hr = rows.get(ticket.ticket_id)
+        if hr is not None and hr.state == "PENDING":
+            pending.append(hr)
+        else:
+            closed.append(ticket)
+    return pending, closed
+
+
+def mark_timed_out(hr: HelpRequest, now: datetime) -> Optional[str]:
+    """Move a ticket to UNRESOLVED (caller commits). Returns the room it held, for release."""
+    hr.state = "UNRESOLVED"
+    hr.resolved_at = now
+    hr.supervisor_answer = "This request timed out. A supervisor will follow up within 24 hours."
+    room_name, hr.room_url = hr.room_url, None
+    return room_name
 
 
 def timeout_worker():
@@ -22,34 +61,38 @@ def timeout_worker():
     
     while True:
         try:
-            with Session(engine) as session:
-                # Find all pending requests
-                pending = session.exec(
-                    select(HelpRequest).where(HelpRequest.state == "PENDING")
-                ).all()
-                
-                current_time = datetime.utcnow()
-                
-                for hr in pending:
-                    # Check if request has timed out
-                    elapsed = current_time - hr.created_at
-                    
-                    if elapsed > timedelta(seconds=SUPERVISOR_TIMEOUT_SECONDS):
-                        print(f"[Timeout] ⏰ Ticket {hr.ticket_id} exceeded {SUPERVISOR_TIMEOUT_SECONDS}s")
-                        
-                        # Mark as unresolved
-                        hr.state = "UNRESOLVED"
-                        hr.resolved_at = current_time
-                        hr.supervisor_answer = "This request timed out. A supervisor will follow up within 24 hours."
-                        
-                        session.add(hr)
-                        session.commit()
-                        
-                        # Notify the caller
-                        notify_caller_followup(hr)
-                        
-                        print(f"[Timeout] Ticket {hr.ticket_id} marked UNRESOLVED and caller notified")
-        
+            current_time = datetime.utcnow()
+
+            # Only expired tickets are visited and loaded from the DB. In a cluster
+            # only the leader sweeps; the other nodes learn about the closures from its events
+            if not cluster.is_leader():
+                time.sleep(CHECK_INTERVAL_SECONDS)
+                continue
+
+            # expire_on_commit=False: the batch-loaded rows stay usable after the commit
+            with Session(engine, expire_on_commit=False) as session:
+                expired, closed = load_expired(session, current_time - timedelta(seconds=SUPERVISOR_TIMEOUT_SECONDS))
+                for ticket in closed:
+                    # Closed elsewhere; clear it from the scheduler and every node too
+                    cluster.ticket_closed(ticket.ticket_id, ticket.tenant_id)
+
+                rooms = []
+                for hr in expired:
+                    print(f"[Timeout] ⏰ Ticket {hr.ticket_id} exceeded {SUPERVISOR_TIMEOUT_SECONDS}s")
+                    rooms.append(mark_timed_out(hr, current_time))
+                    session.add(hr)
+                session.commit()
+
+            for hr, room_name in zip(expired, rooms):
+                cluster.ticket_closed(hr.ticket_id, hr.tenant_id)
+                release_room(room_name)
+                analytics.record_timeout(current_time)
+
+                # Notify the caller
+                notify_caller_followup(hr)
+
+                print(f"[Timeout] Ticket {hr.ticket_id} marked UNRESOLVED and caller notified")
+
         except Exception as e:
             print(f"[Background] Error in timeout worker: {e}")
             # Continue running even if there's an error
@@ -58,11 +101,31 @@ def timeout_worker():
         time.sleep(CHECK_INTERVAL_SECONDS)
 
 
+def archive_worker():
+    """
+    Background thread that keeps the live HelpRequest table small by moving
+    old RESOLVED/UNRESOLVED tickets into the compressed archive.
+    Only the cluster leader archives.
+    """
+    while True:
+        try:
+            if cluster.is_leader():
+                archive_closed_requests()
+        except Exception as e:
+            print(f"[Background] Error in archive worker: {e}")
+
+        time.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
 def start_worker():
     """
-    Start the background timeout worker thread.
+    Start the background timeout and archive worker threads.
     This is called during application startup.
     """
     worker_thread = threading.Thread(target=timeout_worker, daemon=True)
     worker_thread.start()
-    print("[Background] ✓ Timeout worker thread started")
\ No newline at end of file
+    print("[Background] ✓ Timeout worker thread started")
+
+    archive_thread = threading.Thread(target=archive_worker, daemon=True)
+    archive_thread.start()
+    print("[Background] ✓ Archive worker thread started")
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Memory/latency benchmark: pending store vs. the ORM path.
+Fills a throwaway SQLite DB with pending tickets and compares loading them,
+the dashboard listing, the timeout sweep and join lookups. The sweep is
+timed end to end (find, reload, mark UNRESOLVED, write) inside a transaction
+that is rolled back, so every repeat sees the same pending set: once in steady
+state (one check interval's worth expired) and once against a large backlog.
+Run: python -m app.bench_pending_store [ticket_count]
+"""
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlmodel import Session, SQLModel, create_engine, insert, select
+from app.db import HelpRequest
+from app import pending_store
+from app.background import CHECK_INTERVAL_SECONDS, load_expired, mark_timed_out
+
+TICKETS = 100_000
+TENANTS = 20
+LOOKUPS = 1_000
+TIMEOUT = timedelta(seconds=300)
+
+
+def fill(engine, count: int) -> list[str]:
+    now = datetime.utcnow()
+    rows = [
+        {
+            "ticket_id": str(uuid.uuid4()),
+            "tenant_id": f"salon-{i % TENANTS}",
+            "caller": f"+1555{i:07d}",
+            "question": f"Do you have availability for service {i % 500} next week?",
+            # Spread over the last hour; everything older than TIMEOUT is expired
+            "created_at": now - timedelta(seconds=3600 * (count - i) / count),
+            "state": "PENDING",
+            "room_url": f"support-{i}",
+        }
+        for i in range(count)
+    ]
+    with Session(engine) as session:
+        for start in range(0, count, 10_000):
+            session.exec(insert(HelpRequest), params=rows[start:start + 10_000])
+        session.commit()
+    return [row["ticket_id"] for row in rows]
+
+
+def measure(fn):
+    """Run fn once; return (result, seconds, retained bytes, peak bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, current, peak
+
+
+def timed(fn, repeat: int = 5) -> float:
+    """Best-of-repeat wall time in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count: int = TICKETS):
+    tmp = tempfile.TemporaryDirectory()
+    engine = create_engine(f"sqlite:///{Path(tmp.name) / 'bench.db'}")
+    SQLModel.metadata.create_all(engine)
+    ticket_ids = fill(engine, count)
+    lookups = random.Random(7).sample(ticket_ids, LOOKUPS)
+    cutoff = datetime.utcnow() - TIMEOUT
+    # Tickets span the last hour; a sweep every CHECK_INTERVAL_SECONDS only sees the oldest slice
+    steady_cutoff = datetime.utcnow() - timedelta(seconds=3600 - CHECK_INTERVAL_SECONDS)
+    tenant = "salon-3"
+
+    print("=" * 60)
+    print(f"PENDING STORE BENCHMARK ({count:,} pending tickets)")
+    print("=" * 60)
+
+    # --- ORM path (what the workers and dashboard did before) ---
+    def orm_load():
+        with Session(engine, expire_on_commit=False) as session:
+            return session.exec(select(HelpRequest).where(HelpRequest.state == "PENDING")).all()
+
+    orm_rows, orm_load_s, orm_mem, orm_peak = measure(orm_load)
+    del orm_rows
+
+    def orm_dashboard():
+        with Session(engine) as session:
+            return session.exec(
+                select(HelpRequest)
+                .where(HelpRequest.tenant_id == tenant)
+                .where(HelpRequest.state == "PENDING")
+            ).all()
+
+    def write_timeouts(session, expired):
+        now = datetime.utcnow()
+        for hr in expired:
+            mark_timed_out(hr, now)
+            session.add(hr)
+        session.flush()
+        session.rollback()
+
+    def orm_sweep(cutoff: datetime):
+        with Session(engine) as session:
+            pending = session.exec(select(HelpRequest).where(HelpRequest.state == "PENDING")).all()
+            write_timeouts(session, [hr for hr in pending if hr.created_at < cutoff])
+
+    def orm_lookups():
+        with Session(engine) as session:
+            for ticket_id in lookups:
+                session.exec(select(HelpRequest).where(HelpRequest.ticket_id == ticket_id)).first()
+
+    # --- Pending store ---
+    pending_store.engine = engine
+    _, store_load_s, store_mem, store_peak = measure(pending_store.load_from_db)
+
+    def store_lookups():
+        for ticket_id in lookups:
+            pending_store.get(ticket_id)
+
+    def store_sweep(cutoff: datetime):
+        # The background worker's own read path: age-ordered store + batched IN (...) reload
+        with Session(engine) as session:
+            expired, _ = load_expired(session, cutoff)
+            write_timeouts(session, expired)
+
+    results = [
+        ("Load pending set", orm_load_s, store_load_s),
+        (f"Dashboard listing ({tenant})", timed(orm_dashboard), timed(lambda: pending_store.for_tenant(tenant))),
+    ]
+    for label, sweep_cutoff in (("Timeout sweep", steady_cutoff), ("Backlog sweep", cutoff)):
+        expired = len(pending_store.older_than(sweep_cutoff))
+        results.append((
+            f"{label} ({expired:,} expired)",
+            timed(lambda: orm_sweep(sweep_cutoff), 3),
+            timed(lambda: store_sweep(sweep_cutoff), 3),
+        ))
+    results += [
+        (f"Join lookups x{LOOKUPS}", timed(orm_lookups, 3), timed(store_lookups)),
+    ]
+
+    print(f"\n{'Operation':<36}{'ORM':>10}{'Store':>10}{'Speedup':>10}")
+    for name, orm_s, store_s in results:
+        print(f"{name:<36}{orm_s * 1000:>8.1f}ms{store_s * 1000:>8.2f}ms{orm_s / store_s:>9.1f}x")
+
+    mb = 1024 * 1024
+    print(f"\n{'Memory':<36}{'ORM':>10}{'Store':>10}{'Ratio':>10}")
+    print(f"{'Retained':<36}{orm_mem / mb:>8.1f}MB{store_mem / mb:>8.1f}MB{orm_mem / store_mem:>9.1f}x")
+    print(f"{'Peak while loading':<36}{orm_peak / mb:>8.1f}MB{store_peak / mb:>8.1f}MB{orm_peak / store_peak:>9.1f}x")
+    print("=" * 60)
+
+    engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else TICKETS)
@@ -0,0 +1,556 @@
+"""
+Cluster coordination for running several API nodes side by side.
+Nodes share the database and the archive directory (ARCHIVE_DIR must be
+shared storage: the leader writes it, every node reads it) and talk through
+a pluggable message bus:
+- ticket events (created / room ready / closed / assigned) keep every node's
+  pending store and scheduler in sync, so any node can serve the admin view,
+  join tokens and claims
+- room-ready signals wake join_token waiters on whichever node they arrive
+- a leader lease decides which single node runs the timeout sweep, archiving,
+  room reconciliation and supervisor auto-assignment
+- per-ticket leases make supervisor claims exclusive across nodes
+- shared keys and token buckets on the bus back idempotency and per-caller
+  rate limits, and analytics counter deltas are replicated (batched once a
+  second) so /admin/stats is cluster-wide
+- bus I/O stays off the event loop and out of the scheduler lock: events go
+  through an outbox drained by a publisher thread, and request paths that
+  need an answer from the bus call it via asyncio.to_thread
+- pub/sub is at-most-once, so each node also resyncs its pending store from
+  the database every PENDING_RESYNC_SECONDS
+
+Without CLUSTER_BUS_URL the node runs alone on a LocalBus and is always the
+leader, which is exactly the single-process behaviour. Set CLUSTER_BUS_URL to
+redis://host:port/db (requires the redis package) to join a cluster.
+"""
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Optional
+from . import analytics, pending_store, scheduler
+from .pending_store import PendingTicket
+from .tenants import invalidate_kb
+
+LEADER_LEASE = "leader"
+LEADER_LEASE_TTL_SECONDS = 15.0   # A dead leader is replaced within this long
+TICKET_LEASE_TTL_SECONDS = 30.0   # Matches the scheduler's heartbeat TTL; renewed by heartbeats
+PENDING_RESYNC_SECONDS = 60.0     # Catch up on ticket events this node missed
+RESYNC_GRACE_SECONDS = 30.0       # Tickets younger than this may not be committed yet; leave them be
+ANALYTICS_FLUSH_SECONDS = 1.0     # Analytics deltas are published at most this often
+MAX_OUTBOX_MESSAGES = 10_000      # Events waiting for the publisher thread; newer ones dropped past this
+MAX_LOCAL_KEYS = 10_000           # LocalBus drops expired leases/values/buckets past this many
+
+# Channels
+TICKET_CREATED = "ticket.created"
+ROOM_READY = "ticket.room_ready"
+TICKET_CLOSED = "ticket.closed"
+TICKET_ASSIGNED = "ticket.assigned"
+SUPERVISOR_HEARTBEAT = "supervisor.heartbeat"
+KB_CHANGED = "kb.changed"
+ANALYTICS_DELTA = "analytics.delta"
+
+Handler = Callable[[dict], None]
+
+
+class MessageBus(ABC):
+    """
+    Transport between nodes: fire-and-forget pub/sub, named leases, shared
+    values with a TTL and shared token buckets. Handlers may be called from any thread.
+    """
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, handler: Handler):
+        ...
+
+    @abstractmethod
+    def try_lease(self, name: str, owner: str, ttl_seconds: float) -> str:
+        """Take or renew a lease for owner; return whoever holds it afterwards."""
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    def put(self, name: str, value: str, ttl_seconds: float):
+        ...
+
+    @abstractmethod
+    def get(self, name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def take_token(self, name: str, capacity: float, refill_per_second: float) -> bool:
+        """Spend one token from the named bucket; False when it is empty."""
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalBus(MessageBus):
+    """In-process bus: delivers synchronously to every subscriber. Nodes in one process can share it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers: dict[str, list[Handler]] = {}
+        self._leases: dict[str, tuple[str, float]] = {}  # name -> (owner, expires_at)
+        self._values: dict[str, tuple[str, float]] = {}  # name -> (value, expires_at)
+        self._buckets: dict[str, float] = {}  # name -> theoretical arrival time (GCRA)
+
+    def publish(self, channel: str, message: dict):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for handler in handlers:
+            handler(message)
+
+    def subscribe(self, channel: str, handler: Handler):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(handler)
+
+    def try_lease(self, name: str, owner: str, ttl_seconds: float) -> str:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._leases) > MAX_LOCAL_KEYS:
+                self._leases = {k: v for k, v in self._leases.items() if v[1] > now}
+            holder = self._leases.get(name)
+            if holder is None or holder[0] == owner or holder[1] <= now:
+                self._leases[name] = (owner, now + ttl_seconds)
+                return owner
+            return holder[0]
+
+    def release_lease(self, name: str, owner: str):
+        with self._lock:
+            if self._leases.get(name, (None,))[0] == owner:
+                del self._leases[name]
+
+    def put(self, name: str, value: str, ttl_seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._values) > MAX_LOCAL_KEYS:
+                self._values = {k: v for k, v in self._values.items() if v[1] > now}
+            self._values[name] = (value, now + ttl_seconds)
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._values.get(name)
+        return entry[0] if entry and entry[1] > time.monotonic() else None
+
+    def take_token(self, name: str, capacity: float, refill_per_second: float) -> bool:
+        now = time.monotonic()
+        interval = 1 / refill_per_second
+        with self._lock:
+            if len(self._buckets) > MAX_LOCAL_KEYS:
+                self._buckets = {k: tat for k, tat in self._buckets.items() if tat > now}
+            tat = max(self._buckets.get(name, now), now) + interval
+            if tat - now > capacity * interval:
+                return False
+            self._buckets[name] = tat
+            return True
+
+
+class RedisBus(MessageBus):
+    """Redis pub/sub for events, SET-with-expiry keys for leases and values, GCRA scripts for buckets."""
+
+    KEY_PREFIX = "helpdesk:"
+    _TRY_LEASE = """
+        local holder = redis.call('GET', KEYS[1])
+        if not holder or holder == ARGV[1] then
+            redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+            return ARGV[1]
+        end
+        return holder
+    """
+    _RELEASE_LEASE = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+    # Token bucket as GCRA: one stored timestamp, Redis' clock so node clocks don't matter
+    _TAKE_TOKEN = """
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local interval = 1 / tonumber(ARGV[2])
+        local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now) + interval
+        if tat - now > tonumber(ARGV[1]) * interval then
+            return 0
+        end
+        redis.call('SET', KEYS[1], string.format('%.6f', tat), 'PX', math.ceil((tat - now) * 1000))
+        return 1
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("CLUSTER_BUS_URL needs the redis package: pip install redis") from exc
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._try_lease = self._redis.register_script(self._TRY_LEASE)
+        self._release_lease = self._redis.register_script(self._RELEASE_LEASE)
+        self._take_token = self._redis.register_script(self._TAKE_TOKEN)
+        self._thread = None
+
+    def publish(self, channel: str, message: dict):
+        self._redis.publish(self.KEY_PREFIX + channel, json.dumps(message))
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._pubsub.subscribe(**{self.KEY_PREFIX + channel: lambda raw: handler(json.loads(raw["data"]))})
+
+    def try_lease(self, name: str, owner: str, ttl_seconds: float) -> str:
+        return self._try_lease(keys=[self.KEY_PREFIX + "lease:" + name], args=[owner, int(ttl_seconds * 1000)])
+
+    def release_lease(self, name: str, owner: str):
+        self._release_lease(keys=[self.KEY_PREFIX + "lease:" + name], args=[owner])
+
+    def put(self, name: str, value: str, ttl_seconds: float):
+        self._redis.set(self.KEY_PREFIX + "value:" + name, value, px=int(ttl_seconds * 1000))
+
+    def get(self, name: str) -> Optional[str]:
+        return self._redis.get(self.KEY_PREFIX + "value:" + name)
+
+    def take_token(self, name: str, capacity: float, refill_per_second: float) -> bool:
+        return bool(self._take_token(keys=[self.KEY_PREFIX + "bucket:" + name], args=[capacity, refill_per_second]))
+
+    def start(self):
+        self._thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.stop()
+        self._pubsub.close()
+        self._redis.close()
+
+
+_bus: MessageBus = LocalBus()
+_node_id = f"{socket.gethostname()}-{os.getpid()}"
+_is_leader = True
+_clustered = False  # Started on a shared bus rather than alone
+_stop = threading.Event()
+_lease_thread: Optional[threading.Thread] = None
+_outbox: queue.Queue = queue.Queue(maxsize=MAX_OUTBOX_MESSAGES)
+_worker_threads: list[threading.Thread] = []  # Publisher and analytics flusher
+_room_waiters: dict[str, list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+_waiters_lock = threading.Lock()
+_stats = {"published": 0, "received": 0, "leader_changes": 0, "claims_lost": 0, "reserve_errors": 0, "resynced": 0, "dropped": 0}
+
+
+def _publish(channel: str, **message):
+    """Queue an event for the publisher thread; never blocks the caller on the bus."""
+    message["origin"] = _node_id
+    try:
+        _outbox.put_nowait((channel, message))
+    except queue.Full:
+        # Peers catch up through the periodic resync; the local write already happened
+        _stats["dropped"] += 1
+        print(f"[Cluster] Outbox full, dropped {channel}")
+
+
+def _publisher_loop():
+    while True:
+        item = _outbox.get()
+        if item is None:
+            return
+        channel, message = item
+        try:
+            _bus.publish(channel, message)
+            _stats["published"] += 1
+        except Exception as e:
+            print(f"[Cluster] Failed to publish {channel}: {e}")
+
+
+def _analytics_loop():
+    while True:
+        stopping = _stop.wait(ANALYTICS_FLUSH_SECONDS)
+        delta = analytics.take_unsent()
+        if delta:
+            _publish(ANALYTICS_DELTA, **delta)
+        if stopping:
+            return
+
+
+def _from_peer(handler: Handler) -> Handler:
+    """Drop our own messages (their local effects were already applied) and count the rest."""
+    def wrapped(message: dict):
+        if message.get("origin") == _node_id:
+            return
+        _stats["received"] += 1
+        try:
+            handler(message)
+        except Exception as e:
+            print(f"[Cluster] Error handling message from {message.get('origin')}: {e}")
+    return wrapped
+
+
+def _wake_room_waiters(ticket_id: str, room_url: str):
+    with _waiters_lock:
+        waiters = _room_waiters.pop(ticket_id, [])
+    for loop, future in waiters:
+        loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(room_url))
+
+
+# --- Ticket events: apply locally, then tell the other nodes ---
+def ticket_created(hr):
+    pending_store.add(hr)
+    # Announce before enqueueing so peers know the ticket before any assignment for it
+    _publish(
+        TICKET_CREATED,
+        ticket_id=hr.ticket_id, tenant_id=hr.tenant_id, caller=hr.caller, question=hr.question,
+        created_at=hr.created_at.isoformat(), room_url=hr.room_url,
+    )
+    scheduler.enqueue(hr.ticket_id, hr.created_at, hr.tenant_id)
+
+
+def room_ready(ticket_id: str, room_url: str):
+    pending_store.set_room(ticket_id, room_url)
+    _wake_room_waiters(ticket_id, room_url)
+    _publish(ROOM_READY, ticket_id=ticket_id, room_url=room_url)
+
+
+def ticket_closed(ticket_id: str, tenant_id: str):
+    pending_store.remove(ticket_id)
+    scheduler.complete(ticket_id, tenant_id)
+    _publish(TICKET_CLOSED, ticket_id=ticket_id, tenant_id=tenant_id)
+
+
+def kb_changed(tenant_id: str):
+    invalidate_kb(tenant_id)
+    _publish(KB_CHANGED, tenant_id=tenant_id)
+
+
+def heartbeat(supervisor_id: str, tenant_id: str) -> list[str]:
+    """Record a supervisor heartbeat on every node and keep their ticket leases alive."""
+    tickets = scheduler.heartbeat(supervisor_id, tenant_id)
+    _publish(SUPERVISOR_HEARTBEAT, supervisor_id=supervisor_id, tenant_id=tenant_id)
+    try:
+        for ticket_id in tickets:
+            _bus.try_lease(f"ticket:{ticket_id}", supervisor_id, TICKET_LEASE_TTL_SECONDS)
+    except Exception as e:
+        # The next heartbeat renews them; leases outlive a few missed beats
+        print(f"[Cluster] Failed to renew ticket leases for {supervisor_id}: {e}")
+    return tickets
+
+
+async def wait_for_room(ticket_id: str, timeout: float) -> Optional[str]:
+    """Wait until the ticket's room is ready, on this node or any other; None on timeout."""
+    ticket = pending_store.get(ticket_id)
+    if ticket is None:
+        return None
+    if ticket.room_url:
+        return ticket.room_url
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    entry = (loop, future)
+    with _waiters_lock:
+        _room_waiters.setdefault(ticket_id, []).append(entry)
+    try:
+        if ticket.room_url:  # Became ready while registering
+            return ticket.room_url
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        with _waiters_lock:
+            waiters = _room_waiters.get(ticket_id)
+            if waiters and entry in waiters:
+                waiters.remove(entry)
+                if not waiters:
+                    del _room_waiters[ticket_id]
+
+
+# --- Handlers for events from other nodes ---
+def _on_ticket_created(message: dict):
+    pending_store.add(PendingTicket(
+        message["ticket_id"], message["tenant_id"], message["caller"], message["question"],
+        datetime.fromisoformat(message["created_at"]), message["room_url"],
+    ))
+    scheduler.enqueue(message["ticket_id"], datetime.fromisoformat(message["created_at"]), message["tenant_id"])
+
+
+def _on_room_ready(message: dict):
+    pending_store.set_room(message["ticket_id"], message["room_url"])
+    _wake_room_waiters(message["ticket_id"], message["room_url"])
+
+
+def _on_ticket_closed(message: dict):
+    pending_store.remove(message["ticket_id"])
+    scheduler.complete(message["ticket_id"], message["tenant_id"])
+
+
+def _on_ticket_assigned(message: dict):
+    scheduler.record_assignment(message["ticket_id"], message["supervisor_id"], message["tenant_id"])
+
+
+def _on_heartbeat(message: dict):
+    scheduler.heartbeat(message["supervisor_id"], message["tenant_id"])
+
+
+def _on_kb_changed(message: dict):
+    invalidate_kb(message["tenant_id"])
+
+
+def _on_analytics_delta(message: dict):
+    analytics.apply_remote(message)
+
+
+# --- Shared state for modules that would otherwise be per-process ---
+def is_clustered() -> bool:
+    """Whether other nodes may share this node's bus (idempotency and rate limits go through it)."""
+    return _clustered
+
+
+def try_lease(name: str, owner: str, ttl_seconds: float) -> str:
+    return _bus.try_lease(name, owner, ttl_seconds)
+
+
+def release_lease(name: str, owner: str):
+    _bus.release_lease(name, owner)
+
+
+def put_value(name: str, value: str, ttl_seconds: float):
+    _bus.put(name, value, ttl_seconds)
+
+
+def get_value(name: str) -> Optional[str]:
+    return _bus.get(name)
+
+
+def take_token(name: str, capacity: float, refill_per_second: float) -> bool:
+    return _bus.take_token(name, capacity, refill_per_second)
+
+
+# --- Catch-up for missed events ---
+def resync_pending():
+    """Reconcile the pending store and scheduler with the DB (pub/sub may have dropped events)."""
+    added, removed = pending_store.resync_from_db(RESYNC_GRACE_SECONDS)
+    for ticket in added:
+        scheduler.enqueue(ticket.ticket_id, ticket.created_at, ticket.tenant_id)
+    for ticket in removed:
+        scheduler.complete(ticket.ticket_id, ticket.tenant_id)
+    if added or removed:
+        _stats["resynced"] += len(added) + len(removed)
+        print(f"[Cluster] Resync: +{len(added)} / -{len(removed)} pending ticket(s)")
+
+
+# --- Ticket ownership (scheduler hooks) ---
+def _reserve(tenant_id: str, ticket_id: str, supervisor_id: str) -> str:
+    try:
+        owner = _bus.try_lease(f"ticket:{ticket_id}", supervisor_id, TICKET_LEASE_TTL_SECONDS)
+    except Exception as e:
+        # Bus unreachable: go with the local decision rather than strand the ticket
+        # between queued and assigned; a rare double claim beats a lost ticket
+        print(f"[Cluster] Could not reserve ticket {ticket_id}, assigning locally: {e}")
+        _stats["reserve_errors"] += 1
+        return supervisor_id
+    if owner != supervisor_id:
+        _stats["claims_lost"] += 1
+    return owner
+
+
+def _announce_assignment(tenant_id: str, ticket_id: str, supervisor_id: str):
+    _publish(TICKET_ASSIGNED, ticket_id=ticket_id, supervisor_id=supervisor_id, tenant_id=tenant_id)
+
+
+# --- Leadership ---
+def is_leader() -> bool:
+    """Whether this node runs the cluster-wide singleton work (timeouts, archive, reconcile, dispatch)."""
+    return _is_leader
+
+
+def _renew_leadership():
+    global _is_leader
+    try:
+        leader = _bus.try_lease(LEADER_LEASE, _node_id, LEADER_LEASE_TTL_SECONDS) == _node_id
+    except Exception as e:
+        print(f"[Cluster] Lease renewal failed, stepping down: {e}")
+        leader = False
+    if leader != _is_leader:
+        _is_leader = leader
+        _stats["leader_changes"] += 1
+        print(f"[Cluster] Node {_node_id} is {'now the leader' if leader else 'a follower'}")
+        scheduler.set_dispatch(leader)
+
+
+def _lease_loop():
+    next_resync = time.monotonic() + PENDING_RESYNC_SECONDS
+    while not _stop.wait(LEADER_LEASE_TTL_SECONDS / 3):
+        _renew_leadership()
+        if _clustered and time.monotonic() >= next_resync:
+            next_resync = time.monotonic() + PENDING_RESYNC_SECONDS
+            try:
+                resync_pending()
+            except Exception as e:
+                print(f"[Cluster] Pending resync failed: {e}")
+
+
+def start(bus: Optional[MessageBus] = None, node_id: Optional[str] = None):
+    """Join the cluster (or run alone): subscribe to peers, install hooks, elect a leader."""
+    global _bus, _node_id, _lease_thread, _is_leader, _clustered, _worker_threads
+    bus_url = os.getenv("CLUSTER_BUS_URL")
+    _bus = bus or (RedisBus(bus_url) if bus_url else LocalBus())
+    _clustered = bus is not None or bool(bus_url)
+    _node_id = node_id or os.getenv("NODE_ID") or _node_id
+
+    if _clustered and not os.getenv("ARCHIVE_DIR"):
+        print("[Cluster] ⚠ ARCHIVE_DIR is not set; archive reads on this node only see what it archived as leader")
+
+    for channel, handler in (
+        (TICKET_CREATED, _on_ticket_created),
+        (ROOM_READY, _on_room_ready),
+        (TICKET_CLOSED, _on_ticket_closed),
+        (TICKET_ASSIGNED, _on_ticket_assigned),
+        (SUPERVISOR_HEARTBEAT, _on_heartbeat),
+        (KB_CHANGED, _on_kb_changed),
+        (ANALYTICS_DELTA, _on_analytics_delta),
+    ):
+        _bus.subscribe(channel, _from_peer(handler))
+    _bus.start()
+    _stop.clear()
+    _worker_threads = [threading.Thread(target=_publisher_loop, name="cluster-publish", daemon=True)]
+    if _clustered:
+        analytics.configure_cluster()
+        _worker_threads.append(threading.Thread(target=_analytics_loop, name="cluster-analytics", daemon=True))
+    for thread in _worker_threads:
+        thread.start()
+
+    scheduler.configure_cluster(_reserve, _announce_assignment)
+    _is_leader = True  # Dispatching until the first election says otherwise
+    _renew_leadership()
+    _lease_thread = threading.Thread(target=_lease_loop, daemon=True)
+    _lease_thread.start()
+    print(f"[Cluster] ✓ Node {_node_id} started on {type(_bus).__name__} ({'leader' if _is_leader else 'follower'})")
+
+
+def stop():
+    """Leave the cluster, handing leadership over right away."""
+    _stop.set()
+    for thread in _worker_threads[1:]:
+        thread.join(timeout=2)  # Final analytics flush goes into the outbox
+    _outbox.put(None)
+    if _worker_threads:
+        _worker_threads[0].join(timeout=2)
+    try:
+        _bus.release_lease(LEADER_LEASE, _node_id)
+    finally:
+        _bus.close()
+
+
+def cluster_stats() -> dict:
+    with _waiters_lock:
+        waiting = sum(len(w) for w in _room_waiters.values())
+    return {
+        **_stats, "node_id": _node_id, "bus": type(_bus).__name__, "clustered": _clustered,
+        "leader": _is_leader, "room_waiters": waiting, "outbox": _outbox.qsize(),
+    }
@@ -1,7 +1,9 @@
 """
 Database models and configuration for the salon helpdesk system.
 """
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel, Field, create_engine
+from .tracing import instrument_engine
 from datetime import datetime
 from typing import Optional
 import uuid
@@ -12,11 +14,15 @@ engine = create_engine(
     echo=False,  # Set to True for SQL debugging
     connect_args={"check_same_thread": False}
 )
+instrument_engine(engine)  # db.query spans; no-op unless tracing is enabled
+
+DEFAULT_TENANT = "default"  # Salon location used when a request names none
 
 
 class KBEntry(SQLModel, table=True):
     """Knowledge Base entry for frequently asked questions."""
     id: Optional[int] = Field(default=None, primary_key=True)
+    tenant_id: str = Field(default=DEFAULT_TENANT, index=True)  # Salon location owning this entry
     question: str = Field(index=True)  # Index for faster lookups
     answer: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -34,6 +40,7 @@ class HelpRequest(SQLModel, table=True):
         unique=True,
         index=True  # Index for faster lookups
     )
+    tenant_id: str = Field(default=DEFAULT_TENANT, index=True)  # Salon location the caller reached
     caller: str
     question: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -46,6 +53,21 @@ class HelpRequest(SQLModel, table=True):
         return f"<HelpRequest(ticket_id='{self.ticket_id}', caller='{self.caller}', state='{self.state}')>"
 
 
+def _add_tenant_columns():
+    """create_all() won't alter existing tables; add tenant_id to databases created before it existed."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in ("kbentry", "helprequest"):
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if "tenant_id" not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN tenant_id VARCHAR NOT NULL DEFAULT '{DEFAULT_TENANT}'"
+                ))
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_tenant_id ON {table} (tenant_id)"))
+                print(f"[DB] Added tenant_id column to {table}")
+
+
 # Create all tables
 SQLModel.metadata.create_all(engine)
+_add_tenant_columns()
 print("[DB] ✓ Database initialized and tables created")
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Short-lived idempotency store for ticket creation.
+Clients tag each submission with a request id (Idempotency-Key header or a
+request_id field). Retries and double-submits with the same id get the first
+attempt's result instead of creating another ticket, room and notification.
+In a cluster the key is also claimed with a lease on the message bus and the
+result is shared there, so a retry landing on another node is deduplicated
+too. Shared results travel as JSON (tuples come back as lists). Bus calls
+run in a worker thread so a slow bus never stalls the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, TypeVar
+from . import cluster
+
+IDEMPOTENCY_TTL_SECONDS = 600
+MAX_TRACKED_KEYS = 10_000
+MAX_KEY_LENGTH = 128  # Longer keys are stored as their SHA-256 digest
+SHARED_WAIT_SECONDS = 15.0  # Longest a duplicate waits on another node's attempt before running itself
+SHARED_POLL_SECONDS = 0.1
+
+T = TypeVar("T")
+
+# key -> (expires_at, future); insertion order matches expiry order (fixed TTL)
+_entries: "OrderedDict[str, tuple[float, asyncio.Future]]" = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "shared_hits": 0}
+
+
+def _purge(now: float):
+    while _entries:
+        key, (expires_at, _) = next(iter(_entries.items()))
+        if expires_at > now and len(_entries) <= MAX_TRACKED_KEYS:
+            break
+        _entries.popitem(last=False)
+
+
+async def _run_shared(key: str, factory: Callable[[], Awaitable[T]], remember: Callable[[T], bool]) -> T:
+    """
+    Cluster-wide run_once: whoever takes the lease runs factory() and publishes
+    the result; others poll for it. If the holder dies mid-request the waiter
+    gives up after SHARED_WAIT_SECONDS and runs the request itself.
+    """
+    lease, result_key = f"idem:{key}", f"idem-result:{key}"
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + SHARED_WAIT_SECONDS
+    try:
+        while await asyncio.to_thread(cluster.try_lease, lease, owner, IDEMPOTENCY_TTL_SECONDS) != owner:
+            stored = await asyncio.to_thread(cluster.get_value, result_key)
+            if stored is not None:
+                _stats["shared_hits"] += 1
+                print(f"[Idempotency] Replaying result from another node for request {key}")
+                return json.loads(stored)
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+    except Exception as e:
+        # Bus unreachable: this node's own dedupe still applies
+        print(f"[Idempotency] Shared store unavailable for request {key}: {e}")
+        return await factory()
+
+    try:
+        result = await factory()
+    except BaseException:
+        await asyncio.to_thread(_release_quietly, lease, owner)
+        raise
+    try:
+        if remember(result):
+            await asyncio.to_thread(cluster.put_value, result_key, json.dumps(result), IDEMPOTENCY_TTL_SECONDS)
+        else:
+            await asyncio.to_thread(cluster.release_lease, lease, owner)
+    except Exception as e:
+        print(f"[Idempotency] Could not share result for request {key}: {e}")
+    return result
+
+
+def _release_quietly(lease: str, owner: str):
+    try:
+        cluster.release_lease(lease, owner)
+    except Exception as e:
+        print(f"[Idempotency] Could not release {lease}: {e}")
+
+
+async def run_once(
+    key: Optional[str],
+    factory: Callable[[], Awaitable[T]],
+    remember: Callable[[T], bool] = lambda result: True,
+) -> T:
+    """
+    Await factory() at most once per key within the TTL.
+    A duplicate arriving while the first attempt is still running waits for it.
+    Failures, and results for which remember() is false, are forgotten so a
+    later retry runs again. Without a key this is just `await factory()`.
+    """
+    if not key:
+        return await factory()
+    if len(key) > MAX_KEY_LENGTH:
+        # Hash rather than truncate, so long keys sharing a prefix stay distinct
+        key = "sha256:" + hashlib.sha256(key.encode()).hexdigest()
+
+    now = time.monotonic()
+    _purge(now)
+    entry = _entries.get(key)
+    if entry:
+        _stats["hits"] += 1
+        print(f"[Idempotency] Replaying result for request {key}")
+        return await asyncio.shield(entry[1])
+
+    _stats["misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    _entries[key] = (now + IDEMPOTENCY_TTL_SECONDS, future)
+    try:
+        if cluster.is_clustered():
+            result = await _run_shared(key, factory, remember)
+        else:
+            result = await factory()
+    except BaseException as exc:
+        _entries.pop(key, None)
+        if isinstance(exc, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(exc)
+            future.exception()  # Mark retrieved when nobody else was waiting
+        raise
+
+    if not remember(result):
+        _entries.pop(key, None)
+    future.set_result(result)
+    return result
+
+
+def idempotency_stats() -> dict:
+    return {**_stats, "tracked_keys": len(_entries)}
@@ -0,0 +1,184 @@
+"""
+Resilient wrapper around the LiveKit server API.
+Every call gets a deadline, runs under a concurrency limit and goes through a
+circuit breaker, so a slow or down LiveKit fails escalations fast instead of
+hanging them. One pooled HTTP session is reused for all calls.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+import aiohttp
+from livekit import api
+
+LIVEKIT_CALL_TIMEOUT_SECONDS = 5.0  # Deadline per call, including time queued for a slot
+MAX_CONCURRENT_LIVEKIT_CALLS = 20
+BREAKER_FAILURE_THRESHOLD = 5       # Consecutive failures before the breaker opens
+BREAKER_RESET_SECONDS = 30.0        # How long it stays open before a trial call
+ROOM_EMPTY_TIMEOUT_SECONDS = 600
+
+ALREADY_EXISTS = "already_exists"
+NOT_FOUND = "not_found"
+
+T = TypeVar("T")
+
+
+class LiveKitUnavailable(Exception):
+    """A LiveKit call timed out, failed, or was refused because the breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print("[LiveKit] Circuit breaker closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"[LiveKit] Circuit breaker open after {self.failures} failure(s)")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class LiveKitClient:
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        api_secret: str,
+        timeout: float = LIVEKIT_CALL_TIMEOUT_SECONDS,
+        max_concurrency: int = MAX_CONCURRENT_LIVEKIT_CALLS,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lkapi: Optional[api.LiveKitAPI] = None
+        self._stats = {"calls": 0, "failures": 0, "timeouts": 0, "rejected_open": 0, "already_exists": 0}
+
+    def _api(self) -> api.LiveKitAPI:
+        # Created lazily: aiohttp needs a running event loop
+        if self._lkapi is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_LIVEKIT_CALLS, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._lkapi = api.LiveKitAPI(
+                url=self.url, api_key=self.api_key, api_secret=self.api_secret, session=self._session
+            )
+        return self._lkapi
+
+    async def call(self, operation: str, fn: Callable[[api.LiveKitAPI], Awaitable[T]]) -> T:
+        """
+        Run fn(lkapi) with the deadline, concurrency limit and breaker applied.
+        Raises LiveKitUnavailable for timeouts, transport/server errors and an
+        open breaker. Client errors (4xx) are re-raised as api.TwirpError and
+        don't count against LiveKit's health.
+        """
+        if not self.breaker.allow():
+            self._stats["rejected_open"] += 1
+            raise LiveKitUnavailable(f"{operation}: circuit breaker open")
+
+        async def guarded():
+            async with self._semaphore:
+                return await fn(self._api())
+
+        self._stats["calls"] += 1
+        try:
+            result = await asyncio.wait_for(guarded(), self.timeout)
+        except asyncio.TimeoutError as exc:
+            self._stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise LiveKitUnavailable(f"{operation}: timed out after {self.timeout}s") from exc
+        except api.TwirpError as exc:
+            status = getattr(exc, "status", None)
+            if status is not None and status < 500:
+                self.breaker.record_success()  # LiveKit answered; the request was the problem
+                raise
+            self._stats["failures"] += 1
+            self.breaker.record_failure()
+            raise LiveKitUnavailable(f"{operation}: {exc}") from exc
+        except asyncio.CancelledError:
+            self.breaker.trial_in_flight = False  # Let the next caller run the trial instead
+            raise
+        except Exception as exc:
+            self._stats["failures"] += 1
+            self.breaker.record_failure()
+            raise LiveKitUnavailable(f"{operation}: {exc}") from exc
+
+        self.breaker.record_success()
+        return result
+
+    async def create_room(self, room_name: str) -> str:
+        """Create a room and return its name; an existing room with that name counts as success."""
+        try:
+            room = await self.call(
+                "create_room",
+                lambda lk: lk.room.create_room(
+                    api.CreateRoomRequest(name=room_name, empty_timeout=ROOM_EMPTY_TIMEOUT_SECONDS)
+                ),
+            )
+        except api.TwirpError as exc:
+            if exc.code == ALREADY_EXISTS:
+                self._stats["already_exists"] += 1
+                print(f"[LiveKit] Room already exists: {room_name}")
+                return room_name
+            raise LiveKitUnavailable(f"create_room: {exc}") from exc
+        return room.name
+
+    async def delete_room(self, room_name: str) -> bool:
+        """Delete a room; returns False if LiveKit no longer has it."""
+        try:
+            await self.call("delete_room", lambda lk: lk.room.delete_room(api.DeleteRoomRequest(room=room_name)))
+        except api.TwirpError as exc:
+            if exc.code == NOT_FOUND:
+                return False
+            raise LiveKitUnavailable(f"delete_room: {exc}") from exc
+        return True
+
+    async def list_rooms(self) -> list:
+        """All active rooms on the LiveKit server."""
+        response = await self.call("list_rooms", lambda lk: lk.room.list_rooms(api.ListRoomsRequest()))
+        return list(response.rooms)
+
+    async def close(self):
+        if self._lkapi is not None:
+            await self._lkapi.aclose()
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+            self._lkapi = None
+            self._session = None
+
+    def stats(self) -> dict:
+        return {**self._stats, "breaker": self.breaker.state, "consecutive_failures": self.breaker.failures}
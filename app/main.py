@@ -1,83 +1,170 @@
+import asyncio
+import json
 import os
 import uuid
-from fastapi import FastAPI, Form, Request
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import Depends, FastAPI, Form, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
 from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from sqlmodel import Session, select
 from pydantic import BaseModel
 
-from .db import engine, KBEntry, HelpRequest
-from .agent import create_livekit_room, find_in_kb, create_help_request, generate_access_token
+from .db import engine, KBEntry, HelpRequest, DEFAULT_TENANT
+from .agent import create_livekit_room, find_in_kb, create_help_request, generate_access_token, livekit, store_room_name
+from .livekit_client import LiveKitUnavailable
+from .rooms import start_room_manager, stop_room_manager
 from .background import start_worker
+from . import analytics, cluster, pending_store, scheduler, tracing
+from .ratelimit import admit_escalation, release_room_slot, RATE_LIMITED
 from .supervisor import router as supervisor_router
+from .tenants import resolve_tenant
+from .idempotency import run_once
+from .rendering import PrecompressedStaticFiles, QualityAwareGZipMiddleware, precompress_static, render_page
+from .archive import archived_history, archived_totals
 
 class VoiceQuestion(BaseModel):
     question: str
+    request_id: Optional[str] = None  # Client-generated; retries reuse it
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.add_middleware(QualityAwareGZipMiddleware, minimum_size=1000, compresslevel=6)
+app.add_middleware(tracing.TracingMiddleware)  # Outermost: the root span covers compression too
+app.mount("/static", PrecompressedStaticFiles(directory="app/static"), name="static")
 app.include_router(supervisor_router)
 
-templates = Jinja2Templates(directory="app/templates")
+BUSY_MESSAGE = "All supervisors are busy right now. Please try again in a moment."
+RATE_LIMITED_MESSAGE = "You've reached the limit for new requests. Please wait a minute before asking again."
+EARLY_MATCH_MIN_CHARS = 6  # Don't match partial transcripts shorter than this
+STREAM_MESSAGE_TYPES = ("start", "partial", "final")
+
+
+def _client_key(connection: HTTPConnection) -> str:
+    return connection.client.host if connection.client else "unknown"
+
+
+def _shed_status(reason: str) -> int:
+    return 429 if reason == RATE_LIMITED else 503
+
+
+def _shed_message(reason: str) -> str:
+    return RATE_LIMITED_MESSAGE if reason == RATE_LIMITED else BUSY_MESSAGE
+
+
+def _idempotency_key(connection: HTTPConnection, tenant_id: str, endpoint: str, request_id: Optional[str]) -> Optional[str]:
+    # Scoped per endpoint: /call and /ask_voice cache differently shaped results
+    key = connection.headers.get("Idempotency-Key") or request_id
+    return f"{tenant_id}:{endpoint}:{key}" if key else None
+
+
+def _seed_analytics():
+    """
+    Seed analytics from stored tickets. Closed tickets older than the archive
+    cutoff only exist in the archive: their all-time totals come from the
+    rollup and only partitions inside the daily window are decompressed.
+    """
+    analytics.load_totals(archived_totals())
+    since = (datetime.utcnow() - timedelta(days=analytics.DAILY_BUCKETS_KEPT)).date()
+    analytics.load_history(archived_history(since), count_totals=False)
+    with Session(engine) as session:
+        analytics.load_history(session.exec(
+            select(HelpRequest.question, HelpRequest.created_at, HelpRequest.state, HelpRequest.resolved_at)
+        ))
 
 
 # --- Startup event ---
 @app.on_event("startup")
 async def startup():
+    tracing.configure()
+    precompress_static("app/static")
+
     with Session(engine) as session:
-        if not session.exec(select(KBEntry)).first():
+        if not session.exec(select(KBEntry).where(KBEntry.tenant_id == DEFAULT_TENANT)).first():
             session.add(KBEntry(question="Opening hours", answer="9am-7pm Tue-Sat"))
             session.add(KBEntry(question="Walk-ins?", answer="Yes, but appointments preferred"))
             session.commit()
 
+    # Reading the archive and the ticket table is blocking I/O; keep it off the event loop
+    await asyncio.to_thread(_seed_analytics)
+
+    # Join the cluster first so a follower doesn't dispatch while seeding its queue
+    cluster.start()
+
+    # Rebuild the pending store and assignment queue from tickets that survived a restart
+    pending_store.load_from_db()
+    scheduler.load_pending((t.ticket_id, t.created_at, t.tenant_id) for t in pending_store.snapshot())
+
     start_worker()
+    start_room_manager()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_room_manager()
+    await livekit.close()
+    cluster.stop()
+    tracing.flush()
 
 
 # --- Caller form route ---
 @app.get("/", response_class=HTMLResponse)
-async def caller_form(request: Request):
-    return templates.TemplateResponse("caller.html", {"request": request})
+async def caller_form(request: Request, tenant_id: str = Depends(resolve_tenant)):
+    return render_page(request, "caller.html", {"tenant_id": tenant_id}, cacheable=True)
 
 
 # --- Call submission ---
-@app.post("/call", response_class=HTMLResponse)
-async def receive_call(request: Request, caller: str = Form(...), question: str = Form(...)):
-    from .agent import create_livekit_room
-    
-    entry = find_in_kb(question)
+@tracing.traced("escalate_call")
+async def _escalate_call(client_key: str, caller: str, question: str, tenant_id: str) -> Optional[str]:
+    """Admit and create the ticket and its room for a /call submission; returns the shed reason, if any."""
+    analytics.record_kb_lookup(False)  # Here rather than in the handler, so idempotent replays aren't counted
+    shed_reason = await admit_escalation(client_key, tenant_id)
+    if shed_reason:
+        print(f"[Admission] Shed /call from {caller}: {shed_reason}")
+        return shed_reason
+
+    try:
+        hr = create_help_request(caller, question, tenant_id)
 
-    if entry:
-        return HTMLResponse(f"<div>AI Reply: {entry.answer}</div>")
-    else:
-        hr = create_help_request(caller, question)
-        
         # Create the LiveKit room immediately
         room_name = f"support-{hr.ticket_id}"
         try:
             created_room = await create_livekit_room(room_name)
-            
+
             # Update the ticket with room info
-            with Session(engine) as session:
-                db_hr = session.exec(
-                    select(HelpRequest).where(HelpRequest.ticket_id == hr.ticket_id)
-                ).first()
-                if db_hr:
-                    db_hr.room_url = created_room
-                    session.add(db_hr)
-                    session.commit()
-        except Exception as e:
+            store_room_name(hr.ticket_id, created_room)
+        except LiveKitUnavailable as e:
+            # Ticket stays without a room; the supervisor can still follow up
             print(f"[ERROR] Failed to create room: {e}")
+    finally:
+        release_room_slot()
+    return None
+
+
+@app.post("/call", response_class=HTMLResponse)
+async def receive_call(
+    request: Request,
+    caller: str = Form(...),
+    question: str = Form(...),
+    request_id: Optional[str] = Form(None),
+    tenant_id: str = Depends(resolve_tenant),
+):
+    entry = find_in_kb(question, tenant_id)
 
-        # Return caller page with ticket ID so frontend can join voice
-        return templates.TemplateResponse(
-            "caller.html",
-            {
-                "request": request,
-                "ticket_id": hr.ticket_id,
-                "message": "AI: No direct answer found. A supervisor will join shortly via LiveKit.",
-            },
+    if entry:
+        analytics.record_kb_lookup(True)
+        return HTMLResponse(f"<div>AI Reply: {entry.answer}</div>")
+    else:
+        # A double-submitted form replays the first outcome instead of opening another ticket
+        shed_reason = await run_once(
+            _idempotency_key(request, tenant_id, "call", request_id),
+            lambda: _escalate_call(_client_key(request), caller, question, tenant_id),
+            remember=lambda reason: reason is None,
         )
+        if shed_reason:
+            return HTMLResponse(f"<div>{_shed_message(shed_reason)}</div>", status_code=_shed_status(shed_reason))
+
+        # Return the caller page; it only depends on the tenant, so the cached render is reused
+        return render_page(request, "caller.html", {"tenant_id": tenant_id}, cacheable=True)
 
 
 # --- LiveKit join token ---
@@ -87,76 +174,176 @@ async def join_token(ticket_id: str, role: str = "caller"):
     Return a LiveKit join token and connection info for the given ticket.
     role: 'caller' or 'supervisor'
     """
-    import asyncio
-    
-    with Session(engine) as session:
-        hr = session.exec(
-            select(HelpRequest).where(HelpRequest.ticket_id == ticket_id)
-        ).first()
-
-        if not hr:
+    if not pending_store.get(ticket_id):
+        # Closed tickets aren't in the pending store. Their room has been released,
+        # and a token for it would only recreate the room
+        with Session(engine) as session:
+            exists = session.exec(
+                select(HelpRequest.id).where(HelpRequest.ticket_id == ticket_id)
+            ).first()
+        if exists is None:
             return JSONResponse({"error": "ticket not found"}, status_code=404)
+        return JSONResponse({"error": "ticket is already closed"}, status_code=400)
 
-        # Wait a bit for room to be created if not yet available
-        max_retries = 10
-        for i in range(max_retries):
-            if hr.room_url:
-                break
-            await asyncio.sleep(0.5)
-            session.refresh(hr)
-        
-        # Use the room name from DB, or create default
-        room_name = hr.room_url if hr.room_url else f"support-{ticket_id}"
+    # Wait a bit for room to be created if not yet available; the room-ready
+    # signal arrives from whichever node created it
+    room_url = await cluster.wait_for_room(ticket_id, timeout=5.0)
 
-        # Generate an identity and token
-        identity = f"{role}-{uuid.uuid4().hex[:8]}"
-        token = generate_access_token(identity=identity, room_name=room_name, role=role)
+    # Use the stored room name, or create default
+    room_name = room_url if room_url else f"support-{ticket_id}"
 
-        print(f"[JOIN TOKEN] Generated for ticket {ticket_id}, room: {room_name}, identity: {identity}")
+    # Generate an identity and token
+    identity = f"{role}-{uuid.uuid4().hex[:8]}"
+    token = generate_access_token(identity=identity, room_name=room_name, role=role)
 
+    print(f"[JOIN TOKEN] Generated for ticket {ticket_id}, room: {room_name}, identity: {identity}")
+
+    return {
+        "url": os.getenv("LIVEKIT_URL"),
+        "room": room_name,
+        "token": token,
+        "identity": identity,
+    }
+
+@tracing.traced("escalate_voice")
+async def _escalate_voice(client_key: str, question: str, tenant_id: str) -> tuple[dict, int]:
+    """
+    Escalate an unanswered voice question: admit, create the ticket and its room.
+    Returns the response payload and HTTP status code.
+    """
+    analytics.record_kb_lookup(False)  # Here rather than in the handlers, so idempotent replays aren't counted
+    shed_reason = await admit_escalation(client_key, tenant_id)
+    if shed_reason:
+        print(f"[Admission] Shed voice escalation: {shed_reason}")
         return {
-            "url": os.getenv("LIVEKIT_URL"),
-            "room": room_name,
-            "token": token,
-            "identity": identity,
-        }
+            "answer": None,
+            "found": False,
+            "busy": True,
+            "reason": shed_reason,
+            "message": _shed_message(shed_reason),
+        }, _shed_status(shed_reason)
+
+    try:
+        # Need human - create ticket
+        hr = create_help_request("Voice Caller", question, tenant_id)
+
+        # Create room for voice escalation
+        room_name = f"support-{hr.ticket_id}"
+        room_ready = False
+        try:
+            created_room = await create_livekit_room(room_name)
+            store_room_name(hr.ticket_id, created_room)
+            room_ready = True
+        except LiveKitUnavailable as e:
+            print(f"[ERROR] Failed to create room for ticket {hr.ticket_id}: {e}")
+    finally:
+        release_room_slot()
+
+    return {
+        "answer": None,
+        "found": False,
+        "ticket_id": hr.ticket_id,
+        "needs_supervisor": True,
+        "room_ready": room_ready,
+    }, 200
+
 
 @app.post("/ask_voice")
-async def ask_voice(data: VoiceQuestion):
+async def ask_voice(request: Request, data: VoiceQuestion, tenant_id: str = Depends(resolve_tenant)):
     """
     Handle voice question - search KB or escalate
     """
     question = data.question
     
     # Search KB
-    entry = find_in_kb(question)
+    entry = find_in_kb(question, tenant_id)
     
     if entry:
         # Found answer
+        analytics.record_kb_lookup(True)
         return {
             "answer": entry.answer,
             "found": True
         }
     else:
-        # Need human - create ticket
-        hr = create_help_request("Voice Caller", question)
-        
-        # Create room for voice escalation
-        room_name = f"support-{hr.ticket_id}"
-        created_room = await create_livekit_room(room_name)
-        
-        with Session(engine) as session:
-            db_hr = session.exec(
-                select(HelpRequest).where(HelpRequest.ticket_id == hr.ticket_id)
-            ).first()
-            if db_hr:
-                db_hr.room_url = created_room
-                session.add(db_hr)
-                session.commit()
-        
-        return {
-            "answer": None,
-            "found": False,
-            "ticket_id": hr.ticket_id,
-            "needs_supervisor": True
-        }
\ No newline at end of file
+        payload, status_code = await run_once(
+            _idempotency_key(request, tenant_id, "ask_voice", data.request_id),
+            lambda: _escalate_voice(_client_key(request), question, tenant_id),
+            remember=lambda result: result[1] == 200,
+        )
+        return JSONResponse(payload, status_code=status_code)
+
+
+# --- Streaming voice Q&A ---
+async def _receive_stream_message(websocket: WebSocket) -> Optional[dict]:
+    """
+    Next client frame, or None if it isn't a well-formed stream message
+    (not JSON, not an object, unknown type, non-string text/request_id).
+    Raises WebSocketDisconnect when the client goes away.
+    """
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    try:
+        message = json.loads(frame.get("text") or frame.get("bytes") or "")
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or message.get("type") not in STREAM_MESSAGE_TYPES:
+        return None
+    if any(message.get(field) is not None and not isinstance(message[field], str) for field in ("text", "request_id")):
+        return None
+    return message
+
+
+@app.websocket("/ws/ask_voice")
+async def ask_voice_stream(websocket: WebSocket, tenant_id: str = Depends(resolve_tenant)):
+    """
+    Streaming variant of /ask_voice. Per utterance the client sends
+    {"type": "start"}, then {"type": "partial", "text": ...} as the transcript
+    grows, then {"type": "final", "text": ...}. Partials are matched against the
+    KB and the answer is pushed as soon as one matches; the question is only
+    escalated if the final transcript still has no answer.
+    """
+    await websocket.accept()
+    answered = False
+    last_checked = ""
+
+    try:
+        while True:
+            message = await _receive_stream_message(websocket)
+            if message is None:
+                continue  # Malformed frames are dropped; the stream carries on
+            kind = message.get("type")
+            text = (message.get("text") or "").strip()
+
+            if kind == "start":
+                answered, last_checked = False, ""
+                continue
+
+            is_final = kind == "final"
+            if not answered and text != last_checked and (is_final or len(text) >= EARLY_MATCH_MIN_CHARS):
+                last_checked = text
+                entry = find_in_kb(text, tenant_id)
+                if entry:
+                    answered = True
+                    analytics.record_kb_lookup(True)
+                    await websocket.send_json({
+                        "type": "answer",
+                        "answer": entry.answer,
+                        "found": True,
+                        "early": not is_final,
+                    })
+
+            if is_final:
+                if not answered and text:
+                    payload, _ = await run_once(
+                        # Per utterance, so only the message's request_id counts (not connection headers).
+                        # Same scope as /ask_voice: both cache _escalate_voice results
+                        f"{tenant_id}:ask_voice:{message['request_id']}" if message.get("request_id") else None,
+                        lambda: _escalate_voice(_client_key(websocket), text, tenant_id),
+                        remember=lambda result: result[1] == 200,
+                    )
+                    await websocket.send_json({"type": "busy" if payload.get("busy") else "escalated", **payload})
+                answered, last_checked = False, ""
+    except WebSocketDisconnect:
+        pass
\ No newline at end of file
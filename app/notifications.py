@@ -2,7 +2,10 @@
 Notification system for supervisors and callers.
 In production, this would integrate with email, SMS, Slack, etc.
 """
+from .tracing import traced
 
+
+@traced("notify_supervisor")
 def notify_supervisor(hr):
     """
     Notify supervisor about a new help request.
@@ -38,4 +41,12 @@ def notify_caller_followup(hr):
     # TODO: In production, add:
     # - Send email with answer
     # - Send SMS notification
-    # - Update caller's app/portal
\ No newline at end of file
+    # - Update caller's app/portal
+
+
+def notify_supervisor_assignment(supervisor_id, ticket_id):
+    """
+    Notify a supervisor that the scheduler assigned them a ticket.
+    Currently prints to console; the admin page also picks it up via heartbeat.
+    """
+    print(f"[SUPERVISOR NOTIFY] 📋 Ticket {ticket_id} assigned to {supervisor_id}")
@@ -0,0 +1,187 @@
+"""
+Compact in-memory mirror of PENDING help requests.
+Hot read paths (dashboard listing, timeout sweep, join lookups) use these
+__slots__ records instead of loading ORM HelpRequest objects. The DB stays the
+source of truth: every write commits there first and then updates this store.
+
+Records carry no state (everything here is PENDING by definition) but do keep
+caller and question: the dashboard lists both for every pending ticket and
+join_call returns them, so loading them on demand would put a DB read back on
+those paths. The price is that memory grows with question length, and a
+sweep over the store touches larger objects than ids and timestamps alone.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlmodel import Session, select
+from .db import HelpRequest, engine
+
+RECENTLY_CLOSED_SECONDS = 600  # How long closed ids are remembered against stale resyncs
+
+
+class PendingTicket:
+    __slots__ = ("ticket_id", "tenant_id", "caller", "question", "created_at", "room_url")
+
+    def __init__(self, ticket_id, tenant_id, caller, question, created_at, room_url=None):
+        self.ticket_id = ticket_id
+        self.tenant_id = tenant_id
+        self.caller = caller
+        self.question = question
+        self.created_at = created_at
+        self.room_url = room_url
+
+
+_lock = threading.Lock()
+_tickets: dict[str, PendingTicket] = {}
+_by_tenant: dict[str, dict[str, PendingTicket]] = {}
+_by_age: deque = deque()  # (created_at, ticket_id), oldest first; closed tickets skipped lazily
+# ticket_id -> monotonic close time, so a resync from an older DB read can't resurrect them
+_recently_closed: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _insert(ticket: PendingTicket):
+    _tickets[ticket.ticket_id] = ticket
+    _by_tenant.setdefault(ticket.tenant_id, {})[ticket.ticket_id] = ticket
+    entry = (ticket.created_at, ticket.ticket_id)
+    if _by_age and entry < _by_age[-1]:
+        bisect.insort(_by_age, entry)  # Out-of-order insert (rare); keep the deque sorted
+    else:
+        _by_age.append(entry)
+
+
+def _pending_rows() -> list:
+    with Session(engine) as session:
+        return session.exec(
+            select(
+                HelpRequest.ticket_id, HelpRequest.tenant_id, HelpRequest.caller,
+                HelpRequest.question, HelpRequest.created_at, HelpRequest.room_url,
+            )
+            .where(HelpRequest.state == "PENDING")
+            .order_by(HelpRequest.created_at)
+        ).all()
+
+
+def _delete(ticket_id: str) -> Optional[PendingTicket]:
+    ticket = _tickets.pop(ticket_id, None)
+    if ticket:
+        tenant = _by_tenant.get(ticket.tenant_id)
+        if tenant is not None:
+            tenant.pop(ticket_id, None)
+            if not tenant:
+                del _by_tenant[ticket.tenant_id]
+    return ticket
+
+
+def load_from_db():
+    """Rebuild the store from PENDING rows, selecting only the needed columns."""
+    rows = _pending_rows()
+    with _lock:
+        _tickets.clear()
+        _by_tenant.clear()
+        _by_age.clear()
+        for row in rows:
+            _insert(PendingTicket(*row))
+    print(f"[Pending] Loaded {len(rows)} pending ticket(s)")
+
+
+def resync_from_db(grace_seconds: float) -> tuple[list[PendingTicket], list[PendingTicket]]:
+    """
+    Reconcile with the DB after possibly missed cluster events. Returns the
+    (added, removed) tickets. Tickets younger than grace_seconds are kept even
+    if the DB read doesn't show them yet, and tickets closed since the read
+    are not brought back.
+    """
+    keep_after = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    rows = _pending_rows()
+    live = {row[0]: row for row in rows}
+    added, removed = [], []
+    with _lock:
+        for ticket_id in [t for t, ticket in _tickets.items() if t not in live and ticket.created_at < keep_after]:
+            removed.append(_delete(ticket_id))
+        for row in rows:
+            ticket = _tickets.get(row[0])
+            if ticket is None and row[0] not in _recently_closed:
+                ticket = PendingTicket(*row)
+                _insert(ticket)
+                added.append(ticket)
+            elif ticket is not None and ticket.room_url is None:
+                ticket.room_url = row[5]
+    return added, removed
+
+
+def add(hr: HelpRequest):
+    """Mirror a newly committed PENDING ticket."""
+    with _lock:
+        _insert(PendingTicket(hr.ticket_id, hr.tenant_id, hr.caller, hr.question, hr.created_at, hr.room_url))
+
+
+def set_room(ticket_id: str, room_url: Optional[str]):
+    with _lock:
+        ticket = _tickets.get(ticket_id)
+        if ticket:
+            ticket.room_url = room_url
+
+
+def remove(ticket_id: str):
+    """Forget a ticket that left PENDING."""
+    now = time.monotonic()
+    with _lock:
+        _delete(ticket_id)
+        _recently_closed[ticket_id] = now
+        _recently_closed.move_to_end(ticket_id)
+        while _recently_closed and next(iter(_recently_closed.values())) < now - RECENTLY_CLOSED_SECONDS:
+            _recently_closed.popitem(last=False)
+
+
+def get(ticket_id: str) -> Optional[PendingTicket]:
+    with _lock:
+        return _tickets.get(ticket_id)
+
+
+def for_tenant(tenant_id: str) -> list[PendingTicket]:
+    """Pending tickets of one tenant, oldest first."""
+    with _lock:
+        tickets = list(_by_tenant.get(tenant_id, {}).values())
+    tickets.sort(key=lambda t: t.created_at)
+    return tickets
+
+
+def older_than(cutoff: datetime) -> list[PendingTicket]:
+    """Pending tickets created before cutoff. Cost is proportional to the result, not the queue."""
+    expired = []
+    with _lock:
+        for created_at, ticket_id in _by_age:
+            if created_at >= cutoff:
+                break
+            ticket = _tickets.get(ticket_id)
+            if ticket:
+                expired.append(ticket)
+        # Closed tickets are dropped lazily; compact once they dominate the deque
+        while _by_age and _by_age[0][1] not in _tickets:
+            _by_age.popleft()
+        if len(_by_age) > 2 * len(_tickets) + 1024:
+            live = [entry for entry in _by_age if entry[1] in _tickets]
+            _by_age.clear()
+            _by_age.extend(live)
+    return expired
+
+
+def count() -> int:
+    with _lock:
+        return len(_tickets)
+
+
+def count_for_tenant(tenant_id: str) -> int:
+    with _lock:
+        return len(_by_tenant.get(tenant_id, ()))
+
+
+def snapshot() -> list[PendingTicket]:
+    """All pending tickets, oldest first."""
+    with _lock:
+        tickets = list(_tickets.values())
+    tickets.sort(key=lambda t: t.created_at)
+    return tickets
@@ -0,0 +1,141 @@
+"""
+Sampling profiler for the live server.
+A background thread snapshots every thread's Python stack at a fixed interval
+for a bounded window, folds identical stacks together and renders them as a
+self-contained SVG flamegraph (or Brendan Gregg's folded-stack text for
+flamegraph.pl / speedscope). Sampling only reads frames, so the server keeps
+serving while it runs.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from html import escape
+from typing import Optional
+
+MAX_PROFILE_SECONDS = 60.0
+MIN_INTERVAL_SECONDS = 0.001
+
+FLAME_WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 11
+
+_running = threading.Lock()  # One capture at a time
+
+
+class ProfilerBusy(Exception):
+    """Another profile capture is already running."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+def _thread_names() -> dict[int, str]:
+    return {t.ident: t.name for t in threading.enumerate()}
+
+
+def sample(seconds: float, interval: float = 0.005) -> tuple[Counter, int]:
+    """
+    Sample all threads for `seconds`. Returns folded stacks (root-first, ';'
+    separated, prefixed with the thread name) mapped to sample counts, and the
+    number of sampling rounds taken. Raises ProfilerBusy if a capture is running.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("a profile capture is already running")
+    try:
+        seconds = max(0.0, min(seconds, MAX_PROFILE_SECONDS))
+        interval = max(interval, MIN_INTERVAL_SECONDS)
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        rounds = 0
+        names = _thread_names()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = _thread_names()
+                labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                stacks[";".join(reversed(labels))] += 1
+            rounds += 1
+            time.sleep(interval)
+        return stacks, rounds
+    finally:
+        _running.release()
+
+
+def folded(stacks: Counter) -> str:
+    """Folded-stack text: one `frame;frame;frame count` line per distinct stack."""
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(stacks.items())) + "\n"
+
+
+def _build_tree(stacks: Counter) -> dict:
+    root = {"name": "all", "count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "count": 0, "children": {}})
+            node["count"] += count
+    return root
+
+
+def _color(name: str) -> str:
+    # Stable warm colour per function so the same frame looks the same across captures
+    h = sum(ord(c) for c in name)
+    return f"rgb({205 + h % 50},{80 + h % 120},{40 + h % 40})"
+
+
+def flamegraph_svg(stacks: Counter, title: Optional[str] = None) -> str:
+    """Render folded stacks as an SVG flamegraph (root at the bottom; hover for counts)."""
+    tree = _build_tree(stacks)
+    total = tree["count"] or 1
+    rects = []
+
+    def depth_of(node) -> int:
+        return 1 + max((depth_of(child) for child in node["children"].values()), default=0)
+
+    max_depth = depth_of(tree)
+    height = (max_depth + 2) * FRAME_HEIGHT
+
+    def walk(node, x: float, depth: int):
+        width = node["count"] / total * FLAME_WIDTH
+        if width < 0.5:
+            return
+        y = height - (depth + 1) * FRAME_HEIGHT
+        label = escape(node["name"])
+        pct = node["count"] / total * 100
+        chars = int(width / (FONT_SIZE * 0.6))  # Roughly how many monospace characters fit
+        if len(node["name"]) <= chars:
+            text = label
+        elif chars > 3:
+            text = escape(node["name"][:chars - 2]) + ".."
+        else:
+            text = ""
+        rects.append(
+            f'<g><title>{label} ({node["count"]} samples, {pct:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FRAME_HEIGHT - 1}" fill="{_color(node["name"])}"/>'
+            f'<text x="{x + 3:.1f}" y="{y + FRAME_HEIGHT - 4}">{text}</text></g>'
+        )
+        child_x = x
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            walk(child, child_x, depth + 1)
+            child_x += child["count"] / total * FLAME_WIDTH
+
+    walk(tree, 0.0, 0)
+    heading = escape(title or f"{tree['count']} samples")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="{FONT_SIZE}">'
+        f'<rect width="100%" height="100%" fill="#fafafa"/>'
+        f'<text x="{FLAME_WIDTH / 2}" y="{FRAME_HEIGHT}" text-anchor="middle">{heading}</text>'
+        + "".join(rects)
+        + "</svg>"
+    )
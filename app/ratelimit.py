@@ -0,0 +1,136 @@
+"""
+Rate limiting and admission control for the escalation path.
+Keeps a burst of KB misses from flooding the DB, LiveKit and supervisors.
+In a cluster the per-caller buckets live on the message bus, so a caller's
+allowance is shared by every node rather than multiplied by their number.
+Pending tickets are capped overall, protecting the DB and the pending store,
+and per tenant, so one busy salon can't use up the whole allowance and lock
+the others out. Both caps read the replicated pending store and are therefore
+cluster-wide as well; room-creation slots stay per node (local resource).
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+from . import cluster, pending_store
+
+# Per-caller token bucket: a burst of 3 escalations, refilled at 1 every 20s
+CALLER_BUCKET_CAPACITY = 3
+CALLER_REFILL_PER_SECOND = 1 / 20
+BUCKET_IDLE_SECONDS = 600  # Forget callers that have been quiet this long
+
+# Admission limits
+MAX_PENDING_TICKETS = 200  # All tenants together
+MAX_PENDING_TICKETS_PER_TENANT = 50
+MAX_CONCURRENT_ROOM_CREATIONS = 10  # Per node
+
+# Shed reasons (also used as counter keys)
+RATE_LIMITED = "rate_limited"
+QUEUE_FULL = "queue_full"
+ROOMS_BUSY = "rooms_busy"
+
+
+class TokenBucket:
+    """Classic token bucket; callers spend one token per escalation."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def try_take(self, now: float) -> bool:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+_lock = threading.Lock()
+_buckets: dict[str, TokenBucket] = {}
+_rooms_in_flight = 0
+_last_sweep = time.monotonic()
+_counters = {"admitted": 0, RATE_LIMITED: 0, QUEUE_FULL: 0, ROOMS_BUSY: 0}
+
+
+def _sweep_idle_buckets(now: float):
+    """Drop buckets that have refilled completely so the table stays small."""
+    global _last_sweep
+    if now - _last_sweep < BUCKET_IDLE_SECONDS:
+        return
+    _last_sweep = now
+    for key in [k for k, b in _buckets.items() if now - b.updated_at > BUCKET_IDLE_SECONDS]:
+        del _buckets[key]
+
+
+async def admit_escalation(caller_key: str, tenant_id: str) -> Optional[str]:
+    """
+    Decide whether an escalation may go ahead.
+    Returns None when admitted, in which case a room-creation slot is held and
+    must be given back with release_room_slot(). Otherwise returns the shed reason.
+    """
+    global _rooms_in_flight
+    now = time.monotonic()
+
+    # Shared limits first: a caller shed because the system is saturated
+    # shouldn't also spend a token and end up rate-limited later
+    with _lock:
+        if _rooms_in_flight >= MAX_CONCURRENT_ROOM_CREATIONS:
+            _counters[ROOMS_BUSY] += 1
+            return ROOMS_BUSY
+        _rooms_in_flight += 1
+
+    # The pending count comes from the in-memory store, not a COUNT(*) per escalation
+    if (
+        pending_store.count() >= MAX_PENDING_TICKETS
+        or pending_store.count_for_tenant(tenant_id) >= MAX_PENDING_TICKETS_PER_TENANT
+    ):
+        with _lock:
+            _rooms_in_flight -= 1
+            _counters[QUEUE_FULL] += 1
+        return QUEUE_FULL
+
+    allowed = None
+    if cluster.is_clustered():
+        try:
+            allowed = await asyncio.to_thread(
+                cluster.take_token, f"caller:{caller_key}", CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND,
+            )
+        except Exception as e:
+            print(f"[RateLimit] Shared bucket unavailable, using this node's: {e}")
+    with _lock:
+        if allowed is None:
+            _sweep_idle_buckets(now)
+            bucket = _buckets.get(caller_key)
+            if bucket is None:
+                bucket = _buckets[caller_key] = TokenBucket(CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND)
+            allowed = bucket.try_take(now)
+        if not allowed:
+            _rooms_in_flight -= 1
+            _counters[RATE_LIMITED] += 1
+            return RATE_LIMITED
+        _counters["admitted"] += 1
+    return None
+
+
+def release_room_slot():
+    """Give back the room-creation slot taken by a successful admit_escalation()."""
+    global _rooms_in_flight
+    with _lock:
+        _rooms_in_flight = max(0, _rooms_in_flight - 1)
+
+
+def load_stats() -> dict:
+    """Snapshot of admission counters for the admin view."""
+    with _lock:
+        return {
+            **_counters,
+            "rooms_in_flight": _rooms_in_flight,
+            "tracked_callers": len(_buckets),
+            "max_pending_tickets": MAX_PENDING_TICKETS,
+            "max_pending_tickets_per_tenant": MAX_PENDING_TICKETS_PER_TENANT,
+            "max_concurrent_room_creations": MAX_CONCURRENT_ROOM_CREATIONS,
+        }
@@ -0,0 +1,167 @@
+"""
+Page rendering and static file serving with HTTP caching.
+Pages are rendered to bytes with an ETag so unchanged pages cost a 304;
+pages whose context fully determines the output are memoized. Static files
+are gzip-compressed once at startup and served precompressed; on a read-only
+deploy they are simply served uncompressed.
+"""
+import gzip
+import hashlib
+import mimetypes
+import stat
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import anyio
+from fastapi import Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, Response, FileResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+PAGE_CACHE_SIZE = 256
+PAGE_CACHE_CONTROL = "no-cache"  # Always revalidate; an unchanged page costs a 304
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+PRECOMPRESS_SUFFIXES = {".css", ".js", ".svg", ".html", ".txt", ".json"}
+
+templates = Jinja2Templates(directory="app/templates")
+
+_lock = threading.Lock()
+_page_cache: "OrderedDict[tuple, tuple[bytes, str]]" = OrderedDict()
+
+
+def _etag(body: bytes) -> str:
+    # Weak: the same tag covers the gzip-encoded variant produced by the middleware
+    return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _client_has(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match or request.method not in ("GET", "HEAD"):
+        return False
+    tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") in (tag, "*") for candidate in if_none_match.split(","))
+
+
+def render_page(request: Request, name: str, context: dict, cacheable: bool = False) -> Response:
+    """
+    Render a template into an HTMLResponse carrying an ETag, or a 304 when the
+    client already has that version. With cacheable=True the rendered bytes are
+    memoized by template name and context, so only pass it when the context
+    (hashable values only) fully determines the page.
+    """
+    key = (name, tuple(sorted(context.items()))) if cacheable else None
+    cached = None
+    if key:
+        with _lock:
+            cached = _page_cache.get(key)
+            if cached:
+                _page_cache.move_to_end(key)
+
+    if cached:
+        body, etag = cached
+    else:
+        body = templates.get_template(name).render({"request": request, **context}).encode("utf-8")
+        etag = _etag(body)
+        if key:
+            with _lock:
+                _page_cache[key] = (body, etag)
+                while len(_page_cache) > PAGE_CACHE_SIZE:
+                    _page_cache.popitem(last=False)
+
+    headers = {"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL}
+    if _client_has(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
+
+
+# --- Content negotiation ---
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (gzip;q=0 means no)."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+class QualityAwareGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves responses alone for clients refusing gzip via q=0."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and not accepts_gzip(Headers(scope=scope).get("accept-encoding", "")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# --- Static files ---
+def precompress_static(directory: str):
+    """Write a .gz sibling for each compressible static file that lacks a fresh one."""
+    for path in Path(directory).rglob("*"):
+        if not path.is_file() or path.suffix not in PRECOMPRESS_SUFFIXES:
+            continue
+        compressed = path.with_name(path.name + ".gz")
+        try:
+            if compressed.exists() and compressed.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            compressed.write_bytes(gzip.compress(path.read_bytes(), compresslevel=9))
+        except OSError as e:
+            # Read-only deploy: serve this file uncompressed (stale .gz files are ignored)
+            print(f"[Static] Could not precompress {path.name}, serving it uncompressed: {e}")
+            continue
+        print(f"[Static] Precompressed {path.name} -> {compressed.name}")
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves the .gz sibling when the client accepts gzip and the sibling is fresh."""
+
+    def _fresh_gzip(self, path: str):
+        full_path, stat_result = self.lookup_path(path + ".gz")
+        if not stat_result or not stat.S_ISREG(stat_result.st_mode):
+            return None, None
+        _, source_stat = self.lookup_path(path)
+        if source_stat and source_stat.st_mtime > stat_result.st_mtime:
+            return None, None  # Left over from an older build; precompress_static couldn't refresh it
+        return full_path, stat_result
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        if accepts_gzip(request_headers.get("accept-encoding", "")):
+            full_path, stat_result = await anyio.to_thread.run_sync(self._fresh_gzip, path)
+            if stat_result:
+                response = FileResponse(
+                    full_path,
+                    stat_result=stat_result,
+                    media_type=mimetypes.guess_type(path)[0],
+                    headers={
+                        "Content-Encoding": "gzip",
+                        "Vary": "Accept-Encoding",
+                        "Cache-Control": STATIC_CACHE_CONTROL,
+                    },
+                )
+                if self.is_not_modified(response.headers, request_headers):
+                    return Response(status_code=304, headers={
+                        "ETag": response.headers["etag"],
+                        "Cache-Control": STATIC_CACHE_CONTROL,
+                        "Vary": "Accept-Encoding",
+                    })
+                return response
+
+        response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
@@ -0,0 +1,180 @@
+"""
+LiveKit room lifecycle management.
+Rooms are released as soon as their ticket leaves PENDING, and a periodic
+reconcile pass compares the LiveKit room list against ticket state in
+batches to delete orphaned rooms and clear stale room references.
+"""
+import asyncio
+import threading
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import update
+from sqlmodel import Session, select
+from .db import HelpRequest, engine
+from .agent import livekit
+from . import cluster
+from .livekit_client import LiveKitUnavailable
+
+ROOM_PREFIX = "support-"
+ROOM_RECONCILE_INTERVAL_SECONDS = 300
+ROOM_BATCH_SIZE = 50  # Rooms per LiveKit delete burst and per DB lookup
+
+_lock = threading.Lock()
+_pending_release: set[str] = set()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+_stats = {
+    "rooms_released": 0,
+    "orphaned_rooms_found": 0,
+    "orphaned_rooms_deleted": 0,
+    "stale_refs_cleared": 0,
+    "pending_without_room": 0,
+    "last_reconcile_at": None,
+}
+
+
+def release_room(room_name: Optional[str]):
+    """Queue a closed ticket's room for deletion. Safe to call from any thread."""
+    if not room_name:
+        return
+    with _lock:
+        _pending_release.add(room_name)
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def _batches(items: list, size: int = ROOM_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def _delete_rooms(names: list[str]) -> int:
+    """Delete rooms in bounded batches; rooms LiveKit couldn't take are requeued."""
+    deleted = 0
+    for batch in _batches(names):
+        results = await asyncio.gather(*(livekit.delete_room(name) for name in batch), return_exceptions=True)
+        for name, result in zip(batch, results):
+            if isinstance(result, LiveKitUnavailable):
+                with _lock:
+                    _pending_release.add(name)
+            elif isinstance(result, BaseException):
+                print(f"[Rooms] Failed to delete {name}: {result}")
+            elif result:
+                deleted += 1
+    return deleted
+
+
+async def _drain_releases():
+    with _lock:
+        names = sorted(_pending_release)
+        _pending_release.clear()
+    if names:
+        deleted = await _delete_rooms(names)
+        _stats["rooms_released"] += deleted
+        print(f"[Rooms] Released {deleted}/{len(names)} room(s) for closed tickets")
+
+
+def _pending_ticket_ids(ticket_ids: list[str]) -> set[str]:
+    pending = set()
+    with Session(engine) as session:
+        for batch in _batches(ticket_ids, 500):
+            pending.update(session.exec(
+                select(HelpRequest.ticket_id)
+                .where(HelpRequest.ticket_id.in_(batch))
+                .where(HelpRequest.state == "PENDING")
+            ).all())
+    return pending
+
+
+async def reconcile() -> dict:
+    """
+    One reconcile pass:
+    - clear room_url on tickets that are no longer PENDING
+    - delete support rooms whose ticket isn't PENDING (or no longer exists)
+    - count PENDING tickets whose room LiveKit no longer has
+    """
+    with Session(engine) as session:
+        cleared = session.execute(
+            update(HelpRequest)
+            .where(HelpRequest.state != "PENDING")
+            .where(HelpRequest.room_url.is_not(None))
+            .values(room_url=None)
+        ).rowcount
+        session.commit()
+        pending_rooms = set(session.exec(
+            select(HelpRequest.room_url)
+            .where(HelpRequest.state == "PENDING")
+            .where(HelpRequest.room_url.is_not(None))
+        ).all())
+
+    live_rooms = {room.name for room in await livekit.list_rooms() if room.name.startswith(ROOM_PREFIX)}
+
+    # Tickets are inserted before their room is created, so a room whose ticket
+    # is still PENDING is never an orphan even if room_url isn't written yet
+    candidates = sorted(live_rooms - pending_rooms)
+    still_pending = _pending_ticket_ids([name[len(ROOM_PREFIX):] for name in candidates])
+    orphans = [name for name in candidates if name[len(ROOM_PREFIX):] not in still_pending]
+    deleted = await _delete_rooms(orphans)
+
+    report = {
+        "live_rooms": len(live_rooms),
+        "orphaned_rooms": len(orphans),
+        "orphaned_rooms_deleted": deleted,
+        "stale_refs_cleared": cleared,
+        "pending_without_room": len(pending_rooms - live_rooms),
+    }
+    _stats["orphaned_rooms_found"] += len(orphans)
+    _stats["orphaned_rooms_deleted"] += deleted
+    _stats["stale_refs_cleared"] += cleared
+    _stats["pending_without_room"] = report["pending_without_room"]
+    _stats["last_reconcile_at"] = datetime.utcnow().isoformat()
+    if orphans or cleared:
+        print(f"[Rooms] Reconcile: {report}")
+    return report
+
+
+async def _manager():
+    loop = asyncio.get_running_loop()
+    next_reconcile = loop.time()
+    while True:
+        try:
+            await _drain_releases()
+            if loop.time() >= next_reconcile:
+                next_reconcile = loop.time() + ROOM_RECONCILE_INTERVAL_SECONDS
+                if cluster.is_leader():  # One node reconciles for the whole cluster
+                    await reconcile()
+        except LiveKitUnavailable as e:
+            print(f"[Rooms] LiveKit unavailable, will retry: {e}")
+        except Exception as e:
+            print(f"[Rooms] Error in room manager: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=max(0.0, next_reconcile - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_room_manager():
+    """Start the room lifecycle task on the running event loop (called at startup)."""
+    global _loop, _wakeup, _task
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    _task = _loop.create_task(_manager())
+    print("[Rooms] ✓ Room lifecycle manager started")
+
+
+async def stop_room_manager():
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+
+def room_stats() -> dict:
+    with _lock:
+        queued = len(_pending_release)
+    return {**_stats, "queued_releases": queued}
@@ -0,0 +1,378 @@
+"""
+Supervisor assignment scheduler.
+Keeps pending tickets in an in-memory priority queue (oldest first) and hands
+them to the least-loaded online supervisor. Supervisors announce themselves
+with heartbeats from the admin page; silent ones are treated as offline and
+their tickets go back into the queue. Each tenant has its own queue and
+supervisor pool.
+In cluster mode only the leader node dispatches; every node mirrors the
+resulting assignments, and claims are arbitrated cluster-wide (see cluster.py).
+Arbitration is bus I/O, so it never runs under the scheduler lock: dispatch
+assigns optimistically and a worker thread then takes the ticket's lease,
+handing the ticket to the real owner if another node's claim won.
+"""
+import heapq
+import threading
+from collections import deque
+from queue import Empty, SimpleQueue
+from datetime import datetime
+from typing import Callable, Optional
+from .db import DEFAULT_TENANT
+from .notifications import notify_supervisor_assignment
+
+SUPERVISOR_HEARTBEAT_TTL_SECONDS = 30  # Offline after this long without a heartbeat
+MAX_TICKETS_PER_SUPERVISOR = 3
+WAIT_SAMPLE_SIZE = 500  # Recent queue waits kept for percentiles
+
+
+class SupervisorState:
+    def __init__(self, supervisor_id: str, now: datetime, dispatchable: bool = True):
+        self.supervisor_id = supervisor_id
+        self.last_seen = now
+        self.last_assigned = datetime.min
+        self.tickets: set[str] = set()
+        self.online = True
+        # Only heartbeats make a supervisor eligible for auto-assignment; one known
+        # just from a claim keeps its tickets until the heartbeat TTL but gets no more
+        self.dispatchable = dispatchable
+
+
+class TenantQueue:
+    """Pending tickets and supervisors for one tenant. Methods expect _lock to be held."""
+
+    def __init__(self, tenant_id: str):
+        self.tenant_id = tenant_id
+        self.ticket_heap: list[tuple[datetime, str]] = []    # (created_at, ticket_id)
+        self.queued: dict[str, datetime] = {}                # ticket_id -> created_at, still waiting
+        self.assigned: dict[str, tuple[str, datetime]] = {}  # ticket_id -> (supervisor_id, created_at)
+        self.supervisor_heap: list[tuple[int, datetime, str]] = []  # (load, last_assigned, supervisor_id)
+        self.supervisors: dict[str, SupervisorState] = {}
+        self.wait_samples: deque = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self.wait_totals = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+    def push_supervisor(self, sup: SupervisorState):
+        if sup.online and sup.dispatchable and len(sup.tickets) < MAX_TICKETS_PER_SUPERVISOR:
+            heapq.heappush(self.supervisor_heap, (len(sup.tickets), sup.last_assigned, sup.supervisor_id))
+        # Stale entries are skipped lazily; rebuild if they start to dominate
+        if len(self.supervisor_heap) > 4 * len(self.supervisors) + 16:
+            self.supervisor_heap[:] = [
+                (len(s.tickets), s.last_assigned, s.supervisor_id)
+                for s in self.supervisors.values()
+                if s.online and s.dispatchable and len(s.tickets) < MAX_TICKETS_PER_SUPERVISOR
+            ]
+            heapq.heapify(self.supervisor_heap)
+
+    def pop_supervisor(self) -> Optional[SupervisorState]:
+        while self.supervisor_heap:
+            load, last_assigned, supervisor_id = heapq.heappop(self.supervisor_heap)
+            sup = self.supervisors.get(supervisor_id)
+            if (
+                sup and sup.online and sup.dispatchable
+                and load == len(sup.tickets) and last_assigned == sup.last_assigned
+            ):
+                return sup
+        return None
+
+    def pop_ticket(self) -> Optional[tuple[datetime, str]]:
+        while self.ticket_heap:
+            created_at, ticket_id = heapq.heappop(self.ticket_heap)
+            if self.queued.get(ticket_id) == created_at:
+                del self.queued[ticket_id]
+                return created_at, ticket_id
+        return None
+
+    def requeue(self, ticket_id: str, created_at: datetime):
+        self.queued[ticket_id] = created_at
+        heapq.heappush(self.ticket_heap, (created_at, ticket_id))
+
+    def expire_supervisors(self, now: datetime):
+        for sup in self.supervisors.values():
+            if sup.online and (now - sup.last_seen).total_seconds() > SUPERVISOR_HEARTBEAT_TTL_SECONDS:
+                sup.online = False
+                print(f"[Scheduler] Supervisor {sup.supervisor_id} went offline, requeueing {len(sup.tickets)} ticket(s)")
+                for ticket_id in sup.tickets:
+                    _, created_at = self.assigned.pop(ticket_id)
+                    self.requeue(ticket_id, created_at)
+                sup.tickets.clear()
+
+    def record_wait(self, seconds: float):
+        self.wait_samples.append(seconds)
+        self.wait_totals["count"] += 1
+        self.wait_totals["total_seconds"] += seconds
+        self.wait_totals["max_seconds"] = max(self.wait_totals["max_seconds"], seconds)
+
+    def assign(
+        self, ticket_id: str, supervisor_id: str, created_at: datetime, now: datetime, record_wait: bool = True,
+    ) -> SupervisorState:
+        sup = self.supervisors.get(supervisor_id)
+        if sup is None or not sup.online:
+            # Known only through this claim/assignment: track it, don't dispatch to it
+            sup = self.supervisors[supervisor_id] = SupervisorState(supervisor_id, now, dispatchable=False)
+        sup.tickets.add(ticket_id)
+        sup.last_assigned = now
+        self.assigned[ticket_id] = (supervisor_id, created_at)
+        if record_wait:
+            self.record_wait((now - created_at).total_seconds())
+        self.push_supervisor(sup)
+        return sup
+
+    def reassign(self, ticket_id: str, supervisor_id: str, now: datetime):
+        """Move an assigned ticket to the supervisor that actually owns it cluster-wide."""
+        previous, created_at = self.assigned.pop(ticket_id)
+        sup = self.supervisors.get(previous)
+        if sup:
+            sup.tickets.discard(ticket_id)
+            self.push_supervisor(sup)
+        self.assign(ticket_id, supervisor_id, created_at, now, record_wait=False)
+
+    def dispatch(self, now: datetime):
+        """Assign queued tickets while there is both work and a free supervisor."""
+        self.expire_supervisors(now)
+        if not _dispatch_enabled:
+            return  # Cluster follower: assignments arrive from the leader
+        while self.queued:
+            sup = self.pop_supervisor()
+            if sup is None:
+                return
+            created_at, ticket_id = self.pop_ticket()
+            # Provisional until _confirm has taken the cluster-wide lease outside the lock
+            self.assign(ticket_id, sup.supervisor_id, created_at, now)
+            _confirmations.put((self.tenant_id, ticket_id, sup.supervisor_id))
+
+
+_lock = threading.RLock()
+_queues: dict[str, TenantQueue] = {}
+
+# Cluster hooks. _reserve(tenant_id, ticket_id, supervisor_id) returns the
+# supervisor that owns the ticket cluster-wide after trying to take it for
+# supervisor_id; _on_assigned(tenant_id, ticket_id, supervisor_id) announces a
+# new assignment. Single-node defaults: every reservation succeeds, nobody listens.
+_dispatch_enabled = True
+_reserve: Callable[[str, str, str], str] = lambda tenant_id, ticket_id, supervisor_id: supervisor_id
+_on_assigned: Callable[[str, str, str], None] = lambda tenant_id, ticket_id, supervisor_id: None
+
+# Dispatched (tenant_id, ticket_id, supervisor_id) awaiting _confirm. Drained by
+# the confirmation thread once cluster hooks are installed, else inline.
+_confirmations: SimpleQueue = SimpleQueue()
+_confirm_thread: Optional[threading.Thread] = None
+
+
+def _queue(tenant_id: str) -> TenantQueue:
+    queue = _queues.get(tenant_id)
+    if queue is None:
+        queue = _queues[tenant_id] = TenantQueue(tenant_id)
+    return queue
+
+
+def _confirm(tenant_id: str, ticket_id: str, supervisor_id: str):
+    """Take the lease for a dispatched ticket (without _lock), then announce it or defer to the owner."""
+    owner = _reserve(tenant_id, ticket_id, supervisor_id)
+    now = datetime.utcnow()
+    with _lock:
+        queue = _queues.get(tenant_id)
+        current = queue.assigned.get(ticket_id) if queue else None
+        if current is None or current[0] != supervisor_id:
+            return  # Completed or requeued while reserving
+        if owner != supervisor_id:
+            # Claimed on another node first: hand it over and give sup the next ticket
+            queue.reassign(ticket_id, owner, now)
+            queue.dispatch(now)
+            return
+    _on_assigned(tenant_id, ticket_id, supervisor_id)
+    notify_supervisor_assignment(supervisor_id, ticket_id)
+
+
+def _confirm_loop():
+    while True:
+        item = _confirmations.get()
+        try:
+            _confirm(*item)
+        except Exception as e:
+            print(f"[Scheduler] Error confirming assignment of {item[1]}: {e}")
+
+
+def _flush_confirmations():
+    """Confirm dispatched tickets inline when no confirmation thread runs (call without _lock)."""
+    if _confirm_thread is not None:
+        return
+    while True:
+        try:
+            item = _confirmations.get_nowait()
+        except Empty:
+            return
+        _confirm(*item)
+
+
+# --- Public API ---
+def enqueue(ticket_id: str, created_at: datetime, tenant_id: str = DEFAULT_TENANT):
+    """Add a new pending ticket and try to assign it right away."""
+    with _lock:
+        queue = _queue(tenant_id)
+        if ticket_id in queue.queued or ticket_id in queue.assigned:
+            return
+        queue.requeue(ticket_id, created_at)
+        queue.dispatch(datetime.utcnow())
+    _flush_confirmations()
+
+
+def complete(ticket_id: str, tenant_id: str = DEFAULT_TENANT):
+    """Drop a ticket that left PENDING (resolved or timed out) and free its supervisor."""
+    with _lock:
+        queue = _queues.get(tenant_id)
+        if queue is None:
+            return  # e.g. a peer's ticket closed before this node ever saw the tenant
+        queue.queued.pop(ticket_id, None)
+        owner = queue.assigned.pop(ticket_id, None)
+        if owner:
+            sup = queue.supervisors.get(owner[0])
+            if sup:
+                sup.tickets.discard(ticket_id)
+                queue.push_supervisor(sup)
+        queue.dispatch(datetime.utcnow())
+    _flush_confirmations()
+
+
+def heartbeat(supervisor_id: str, tenant_id: str = DEFAULT_TENANT) -> list[str]:
+    """Mark a supervisor online and return the tickets currently assigned to them."""
+    now = datetime.utcnow()
+    with _lock:
+        queue = _queue(tenant_id)
+        sup = queue.supervisors.get(supervisor_id)
+        if sup is None:
+            sup = queue.supervisors[supervisor_id] = SupervisorState(supervisor_id, now)
+            print(f"[Scheduler] Supervisor {supervisor_id} online for {tenant_id}")
+            queue.push_supervisor(sup)
+        else:
+            sup.last_seen = now
+            if not sup.online or not sup.dispatchable:
+                print(f"[Scheduler] Supervisor {supervisor_id} {'back ' if sup.dispatchable else ''}online for {tenant_id}")
+                sup.online = sup.dispatchable = True
+                queue.push_supervisor(sup)
+        queue.dispatch(now)
+        tickets = sorted(sup.tickets)
+    _flush_confirmations()
+    return tickets
+
+
+def claim(ticket_id: str, supervisor_id: str, tenant_id: str = DEFAULT_TENANT) -> Optional[str]:
+    """
+    Let a supervisor take a ticket when joining its call.
+    Returns the owning supervisor id after the claim, so a caller can tell
+    whether the ticket belongs to someone else. Returns None for unknown tickets.
+    """
+    now = datetime.utcnow()
+    with _lock:
+        queue = _queue(tenant_id)
+        queue.expire_supervisors(now)
+        owner = queue.assigned.get(ticket_id)
+        if owner:
+            return owner[0]
+        if ticket_id not in queue.queued:
+            return None
+        # Hold it for the claimer while the cluster-wide lease is taken outside the lock
+        queue.assign(ticket_id, supervisor_id, queue.queued.pop(ticket_id), now)
+
+    owner = _reserve(tenant_id, ticket_id, supervisor_id)
+    with _lock:
+        current = queue.assigned.get(ticket_id)
+        if current is None or current[0] != supervisor_id:
+            return current[0] if current else owner  # Closed or moved meanwhile
+        if owner != supervisor_id:
+            queue.reassign(ticket_id, owner, now)
+        else:
+            queue.supervisors[supervisor_id].last_seen = now
+    if owner == supervisor_id:
+        _on_assigned(tenant_id, ticket_id, supervisor_id)
+    _flush_confirmations()
+    return owner
+
+
+def record_assignment(ticket_id: str, supervisor_id: str, tenant_id: str = DEFAULT_TENANT):
+    """Mirror an assignment made on another cluster node."""
+    now = datetime.utcnow()
+    with _lock:
+        queue = _queue(tenant_id)
+        created_at = queue.queued.pop(ticket_id, None)
+        if created_at is not None:
+            queue.assign(ticket_id, supervisor_id, created_at, now)
+
+
+def configure_cluster(
+    reserve: Callable[[str, str, str], str],
+    on_assigned: Callable[[str, str, str], None],
+):
+    """Install the cluster ownership hooks (see cluster.py) and confirm assignments off the caller's thread."""
+    global _reserve, _on_assigned, _confirm_thread
+    with _lock:
+        _reserve = reserve
+        _on_assigned = on_assigned
+        if _confirm_thread is None:
+            _confirm_thread = threading.Thread(target=_confirm_loop, name="scheduler-confirm", daemon=True)
+            _confirm_thread.start()
+
+
+def set_dispatch(enabled: bool):
+    """Turn assignment on (cluster leader or single node) or off (follower)."""
+    global _dispatch_enabled
+    now = datetime.utcnow()
+    with _lock:
+        _dispatch_enabled = enabled
+        if enabled:
+            for queue in _queues.values():
+                queue.dispatch(now)
+    _flush_confirmations()
+
+
+def assignments(tenant_id: str = DEFAULT_TENANT) -> dict[str, str]:
+    """Map of ticket_id -> supervisor_id for every assigned ticket of the tenant."""
+    with _lock:
+        queue = _queues.get(tenant_id)
+        if queue is None:
+            return {}
+        return {ticket_id: owner[0] for ticket_id, owner in queue.assigned.items()}
+
+
+def load_pending(tickets):
+    """Seed the queues from (ticket_id, created_at, tenant_id) triples, e.g. PENDING rows at startup."""
+    with _lock:
+        touched = set()
+        for ticket_id, created_at, tenant_id in tickets:
+            queue = _queue(tenant_id)
+            if ticket_id not in queue.queued and ticket_id not in queue.assigned:
+                queue.requeue(ticket_id, created_at)
+                touched.add(tenant_id)
+        now = datetime.utcnow()
+        for tenant_id in touched:
+            _queues[tenant_id].dispatch(now)
+    _flush_confirmations()
+
+
+def scheduler_stats(tenant_id: str = DEFAULT_TENANT) -> dict:
+    """Queue depth, supervisor load and queue wait-time metrics for a tenant."""
+    with _lock:
+        # Reading stats must not create state for tenants the scheduler has never seen
+        queue = _queues.get(tenant_id) or TenantQueue(tenant_id)
+        samples = sorted(queue.wait_samples)
+        count = queue.wait_totals["count"]
+
+        def percentile(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3)
+
+        return {
+            "tenant_id": tenant_id,
+            "queued": len(queue.queued),
+            "assigned": len(queue.assigned),
+            "supervisors_online": sum(1 for s in queue.supervisors.values() if s.online and s.dispatchable),
+            "supervisor_load": {
+                s.supervisor_id: len(s.tickets) for s in queue.supervisors.values() if s.online
+            },
+            "wait_seconds": {
+                "count": count,
+                "mean": round(queue.wait_totals["total_seconds"] / count, 3) if count else None,
+                "max": round(queue.wait_totals["max_seconds"], 3),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+            },
+        }
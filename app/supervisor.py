@@ -1,85 +1,220 @@
-from datetime import datetime
-from fastapi import APIRouter, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+import asyncio
+from datetime import date, datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Form, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, JSONResponse, Response
 from sqlmodel import Session, select
 import os
 
-from .db import engine, HelpRequest, KBEntry
+from .db import engine, HelpRequest, KBEntry, DEFAULT_TENANT
 from .notifications import notify_caller_followup
-from .agent import generate_access_token
+from .agent import generate_access_token, livekit
+from .ratelimit import load_stats
+from . import analytics, cluster, pending_store, profiling, scheduler, tracing
+from .archive import archive_report
+from .tenants import resolve_tenant, kb_cache_stats
+from .rendering import render_page
+from .idempotency import idempotency_stats
+from .rooms import reconcile, release_room, room_stats
 
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+
+def _admin_url(tenant_id: str) -> str:
+    return "/admin" if tenant_id == DEFAULT_TENANT else f"/admin?tenant={tenant_id}"
 
 
 # --- Admin dashboard ---
 @router.get("/admin", response_class=HTMLResponse)
-async def admin_page(request: Request):
+async def admin_page(request: Request, tenant_id: str = Depends(resolve_tenant)):
+    pending = pending_store.for_tenant(tenant_id)
     with Session(engine) as session:
-        pending = session.exec(
-            select(HelpRequest).where(HelpRequest.state == "PENDING")
-        ).all()
         resolved = session.exec(
-            select(HelpRequest).where(HelpRequest.state != "PENDING")
+            select(HelpRequest)
+            .where(HelpRequest.tenant_id == tenant_id)
+            .where(HelpRequest.state != "PENDING")
         ).all()
-        kb = session.exec(select(KBEntry)).all()
+        kb = session.exec(select(KBEntry).where(KBEntry.tenant_id == tenant_id)).all()
 
-    return templates.TemplateResponse(
+    return render_page(
+        request,
         "admin.html",
         {
-            "request": request,
             "pending_requests": pending,
             "resolved_requests": resolved,
             "kb": kb,
+            "assignments": scheduler.assignments(tenant_id),
+            "tenant_id": tenant_id,
         },
     )
 
 
+# --- Admission / shed-load counters ---
+@router.get("/admin/load")
+async def admission_load():
+    """Return rate-limit, admission, idempotency, KB cache, LiveKit client and cluster counters as JSON."""
+    return JSONResponse({
+        **load_stats(),
+        "kb_cache": kb_cache_stats(),
+        "idempotency": idempotency_stats(),
+        "livekit": livekit.stats(),
+        "rooms": room_stats(),
+        "pending_tickets": pending_store.count(),
+        "cluster": cluster.cluster_stats(),
+    })
+
+
+# --- Room reconciliation ---
+@router.post("/admin/rooms/reconcile")
+async def reconcile_rooms():
+    """Run a room reconcile pass now and return the orphaned-room report."""
+    return JSONResponse(await reconcile())
+
+
+# --- Tracing ---
+@router.get("/admin/traces")
+async def recent_traces(limit: int = 20):
+    """Recent request traces (OTLP-style spans) and per-span latency summary."""
+    return JSONResponse({
+        "enabled": tracing.is_enabled(),
+        "summary": tracing.span_summary(),
+        "traces": tracing.recent_traces(limit),
+    })
+
+
+@router.post("/admin/traces")
+async def toggle_tracing(enabled: bool = Form(...)):
+    """Turn span collection on or off without a restart."""
+    tracing.set_enabled(enabled)
+    return JSONResponse({"enabled": tracing.is_enabled()})
+
+
+# --- Sampling profiler ---
+@router.get("/admin/profile")
+async def capture_profile(seconds: float = 10.0, interval_ms: float = 5.0, format: str = "svg"):
+    """
+    Sample every thread of the live server for `seconds` (max 60) and return
+    a flamegraph: format=svg (default) or format=folded for folded-stack text.
+    """
+    if format not in ("svg", "folded"):
+        raise HTTPException(status_code=400, detail="format must be svg or folded")
+    try:
+        # Sample from a worker thread so the event loop keeps serving (and shows up in the profile)
+        stacks, rounds = await asyncio.to_thread(profiling.sample, seconds, interval_ms / 1000)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "folded":
+        return PlainTextResponse(profiling.folded(stacks))
+    title = f"{rounds} sampling rounds over {min(seconds, profiling.MAX_PROFILE_SECONDS):g}s"
+    return Response(profiling.flamegraph_svg(stacks, title), media_type="image/svg+xml")
+
+
+# --- Supervisor presence heartbeat ---
+@router.post("/admin/heartbeat")
+async def supervisor_heartbeat(supervisor_id: str = Form(...), tenant_id: str = Depends(resolve_tenant)):
+    """
+    Keep a supervisor marked online for the scheduler.
+    Returns the tickets currently assigned to them.
+    """
+    # Renewing ticket leases is bus I/O; keep it off the event loop
+    tickets = await asyncio.to_thread(cluster.heartbeat, supervisor_id, tenant_id)
+    return JSONResponse({"supervisor_id": supervisor_id, "tickets": tickets})
+
+
+# --- Scheduler metrics ---
+@router.get("/admin/scheduler")
+async def scheduler_metrics(tenant_id: str = Depends(resolve_tenant)):
+    """Return queue depth, supervisor load and queue wait-time metrics."""
+    return JSONResponse(scheduler.scheduler_stats(tenant_id))
+
+
+# --- Analytics ---
+@router.get("/admin/stats")
+async def admin_stats():
+    """
+    KB hit ratio, escalation volume, time-to-resolve and timeout rate from the
+    precomputed rollups, plus the most frequent unanswered questions.
+    """
+    return JSONResponse(analytics.stats())
+
+
+# --- Archive reporting ---
+@router.get("/admin/archive")
+async def archived_requests(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 100,
+    tenant_id: str = Depends(resolve_tenant),
+):
+    """
+    Report over archived tickets created between start and end (YYYY-MM-DD, inclusive).
+    Returns per-day/per-state counts and up to `limit` rows.
+    """
+    # Decompressing the partitions is blocking I/O; keep it off the event loop
+    return JSONResponse(await asyncio.to_thread(archive_report, start, end, limit, tenant_id))
+
+
 # --- Supervisor join voice call ---
 @router.get("/admin/join_call/{ticket_id}")
-async def supervisor_join_call(ticket_id: str):
+async def supervisor_join_call(ticket_id: str, supervisor_id: Optional[str] = None):
     """
     Generate a LiveKit token for supervisor to join the voice call.
+    When supervisor_id is given, the ticket is claimed for that supervisor and
+    tickets assigned to someone else are refused.
     Returns JSON with connection details.
     """
-    with Session(engine) as session:
-        hr = session.exec(
-            select(HelpRequest).where(HelpRequest.ticket_id == ticket_id)
-        ).first()
-
-        if not hr:
+    # Only pending tickets can be joined, so the in-memory store answers this without the DB
+    hr = pending_store.get(ticket_id)
+    if not hr:
+        with Session(engine) as session:
+            exists = session.exec(
+                select(HelpRequest.id).where(HelpRequest.ticket_id == ticket_id)
+            ).first()
+        if exists is None:
             return JSONResponse(
                 {"error": "Ticket not found"},
                 status_code=404
             )
+        return JSONResponse(
+            {"error": "Ticket is already closed"},
+            status_code=400
+        )
+
+    if not hr.room_url:
+        return JSONResponse(
+            {"error": "Room not created yet. Ask caller to connect first."},
+            status_code=400
+        )
 
-        if not hr.room_url:
+    if supervisor_id:
+        owner = await asyncio.to_thread(scheduler.claim, ticket_id, supervisor_id, hr.tenant_id)
+        if owner and owner != supervisor_id:
             return JSONResponse(
-                {"error": "Room not created yet. Ask caller to connect first."},
-                status_code=400
+                {"error": f"Ticket is assigned to {owner}"},
+                status_code=409
             )
 
-        # Generate supervisor token
-        import uuid
-        supervisor_identity = f"supervisor-{uuid.uuid4().hex[:8]}"
-        token = generate_access_token(
-            identity=supervisor_identity,
-            room_name=hr.room_url,
-            role="supervisor"
-        )
+    # Generate supervisor token
+    import uuid
+    supervisor_identity = supervisor_id or f"supervisor-{uuid.uuid4().hex[:8]}"
+    token = generate_access_token(
+        identity=supervisor_identity,
+        room_name=hr.room_url,
+        role="supervisor"
+    )
 
-        print(f"[SUPERVISOR] Joining call for ticket {ticket_id}, room: {hr.room_url}")
+    print(f"[SUPERVISOR] Joining call for ticket {ticket_id}, room: {hr.room_url}")
 
-        return JSONResponse({
-            "url": os.getenv("LIVEKIT_URL"),
-            "room": hr.room_url,
-            "token": token,
-            "identity": supervisor_identity,
-            "caller": hr.caller,
-            "question": hr.question
-        })
+    return JSONResponse({
+        "url": os.getenv("LIVEKIT_URL"),
+        "room": hr.room_url,
+        "token": token,
+        "identity": supervisor_identity,
+        "caller": hr.caller,
+        "question": hr.question
+    })
 
 
 # --- Resolve help request ---
@@ -93,56 +228,76 @@ async def resolve_request(ticket_id: str = Form(...), answer: str = Form(...)):
         if not hr:
             raise HTTPException(status_code=404, detail="Ticket not found")
 
-        # Update help request
+        # Only a PENDING ticket is resolved (and counted, and its room freed). A double
+        # submit or an answer to a timed-out ticket just updates the answer and the KB
+        was_pending = hr.state == "PENDING"
         hr.supervisor_answer = answer
-        hr.state = "RESOLVED"
-        hr.resolved_at = datetime.utcnow()
+        if was_pending:
+            hr.state = "RESOLVED"
+            hr.resolved_at = datetime.utcnow()
+            room_name, hr.room_url = hr.room_url, None
         session.add(hr)
 
         # Update or insert KB entry
         kb_entry = session.exec(
-            select(KBEntry).where(KBEntry.question == hr.question)
+            select(KBEntry)
+            .where(KBEntry.tenant_id == hr.tenant_id)
+            .where(KBEntry.question == hr.question)
         ).first()
 
         if kb_entry:
             kb_entry.answer = answer
         else:
-            session.add(KBEntry(question=hr.question, answer=answer))
+            session.add(KBEntry(tenant_id=hr.tenant_id, question=hr.question, answer=answer))
 
         session.commit()
+        if was_pending:
+            cluster.ticket_closed(ticket_id, hr.tenant_id)
+            release_room(room_name)
+            analytics.record_resolved(hr.created_at, hr.resolved_at)
 
-        # Notify the caller about resolution
-        notify_caller_followup(hr)
+            # Notify the caller about resolution
+            notify_caller_followup(hr)
+        cluster.kb_changed(hr.tenant_id)
+        tenant_id = hr.tenant_id
 
-    return RedirectResponse(url="/admin", status_code=303)
+    return RedirectResponse(url=_admin_url(tenant_id), status_code=303)
 
 
 # --- Add KB entry manually ---
 @router.post("/admin/kb/add")
-async def add_kb_entry(question: str = Form(...), answer: str = Form(...)):
+async def add_kb_entry(
+    question: str = Form(...),
+    answer: str = Form(...),
+    tenant_id: str = Depends(resolve_tenant),
+):
     with Session(engine) as session:
         # Check if exists
         existing = session.exec(
-            select(KBEntry).where(KBEntry.question == question)
+            select(KBEntry)
+            .where(KBEntry.tenant_id == tenant_id)
+            .where(KBEntry.question == question)
         ).first()
 
         if existing:
             existing.answer = answer
         else:
-            session.add(KBEntry(question=question, answer=answer))
+            session.add(KBEntry(tenant_id=tenant_id, question=question, answer=answer))
         
         session.commit()
+    cluster.kb_changed(tenant_id)
 
-    return RedirectResponse(url="/admin", status_code=303)
+    return RedirectResponse(url=_admin_url(tenant_id), status_code=303)
 
 
 # --- Delete KB entry ---
 @router.post("/admin/kb/delete")
-async def delete_kb_entry(kb_id: int = Form(...)):
+async def delete_kb_entry(kb_id: int = Form(...), tenant_id: str = Depends(resolve_tenant)):
     with Session(engine) as session:
         kb = session.get(KBEntry, kb_id)
-        if kb:
+        if kb and kb.tenant_id == tenant_id:
             session.delete(kb)
             session.commit()
+    cluster.kb_changed(tenant_id)
 
-    return RedirectResponse(url="/admin", status_code=303)
\ No newline at end of file
+    return RedirectResponse(url=_admin_url(tenant_id), status_code=303)
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Tenant (salon location) resolution and per-tenant knowledge base indexes.
+Each tenant's KB is loaded into memory on first lookup and kept in an LRU
+cache bounded both by tenant count and by total entries, so one process can
+serve many locations without scanning other tenants' rows.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.requests import HTTPConnection
+from sqlmodel import Session, select
+from .db import engine, KBEntry, DEFAULT_TENANT
+
+MAX_CACHED_TENANTS = 1000
+MAX_CACHED_KB_ENTRIES = 200_000  # Evict least recently used tenants past this total
+
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+# --- Tenant resolution ---
+def resolve_tenant(connection: HTTPConnection) -> str:
+    """
+    FastAPI dependency (HTTP and WebSocket): tenant from the X-Tenant-ID header
+    or ?tenant= query parameter, falling back to the default tenant.
+    """
+    tenant_id = connection.headers.get("X-Tenant-ID") or connection.query_params.get("tenant") or DEFAULT_TENANT
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise HTTPException(status_code=400, detail="Invalid tenant id")
+    return tenant_id
+
+
+# --- Per-tenant KB index ---
+class KBIndex:
+    """A tenant's KB entries with their match keys precomputed."""
+
+    def __init__(self, entries: list[KBEntry]):
+        self.entries = [(entry.question.strip().lower(), entry) for entry in entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match(self, question: str) -> Optional[KBEntry]:
+        text = question.lower()
+        for key, entry in self.entries:
+            if key in text:
+                return entry
+        return None
+
+
+_lock = threading.Lock()
+_indexes: "OrderedDict[str, KBIndex]" = OrderedDict()
+_cached_entries = 0
+# Bumped on every invalidation so in-flight loads of old data are dropped. One
+# counter for all tenants keeps this O(1) in memory; a load racing another
+# tenant's change is merely not cached.
+_generation = 0
+
+
+def _load_index(tenant_id: str) -> KBIndex:
+    with Session(engine) as session:
+        entries = session.exec(
+            select(KBEntry).where(KBEntry.tenant_id == tenant_id).order_by(KBEntry.id)
+        ).all()
+    return KBIndex(list(entries))
+
+
+def get_kb_index(tenant_id: str) -> KBIndex:
+    """Return the tenant's KB index, loading it and evicting LRU tenants as needed."""
+    global _cached_entries
+    with _lock:
+        index = _indexes.get(tenant_id)
+        if index is not None:
+            _indexes.move_to_end(tenant_id)
+            return index
+        generation = _generation
+
+    # Load outside the lock; a concurrent duplicate load is harmless
+    index = _load_index(tenant_id)
+
+    with _lock:
+        if _generation != generation:
+            return index  # KB changed while loading; use it once but don't cache it
+        previous = _indexes.pop(tenant_id, None)
+        if previous is not None:
+            _cached_entries -= len(previous)
+        _indexes[tenant_id] = index
+        _cached_entries += len(index)
+        while len(_indexes) > 1 and (
+            len(_indexes) > MAX_CACHED_TENANTS or _cached_entries > MAX_CACHED_KB_ENTRIES
+        ):
+            _, evicted = _indexes.popitem(last=False)
+            _cached_entries -= len(evicted)
+    return index
+
+
+def invalidate_kb(tenant_id: str):
+    """Drop a tenant's cached index after its KB changes; it reloads on next lookup."""
+    global _cached_entries, _generation
+    with _lock:
+        _generation += 1
+        index = _indexes.pop(tenant_id, None)
+        if index is not None:
+            _cached_entries -= len(index)
+
+
+def kb_cache_stats() -> dict:
+    with _lock:
+        return {"tenants_cached": len(_indexes), "entries_cached": _cached_entries}
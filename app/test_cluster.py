@@ -0,0 +1,176 @@
+"""
+Cluster coordination check on the in-process LocalBus.
+This process plays node-a; a second node (node-b) is simulated by publishing
+its events and holding its leases on the same bus. No Redis needed.
+Run: python -m app.test_cluster
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from app import analytics, cluster, pending_store, scheduler
+from app.cluster import LocalBus, MessageBus
+from app.idempotency import run_once
+from app.pending_store import PendingTicket
+from app.ratelimit import CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND
+
+TENANT = "cluster-check"
+
+
+def peer_event(bus: LocalBus, channel: str, **message):
+    bus.publish(channel, {**message, "origin": "node-b"})
+
+
+async def main():
+    bus = LocalBus()
+    cluster.start(bus=bus, node_id="node-a")
+    checks = []
+
+    print("=" * 60)
+    print("CLUSTER COORDINATION (LocalBus)")
+    print("=" * 60)
+
+    # 1. Leases are exclusive until they expire
+    first = bus.try_lease("probe", "node-a", 0.2)
+    second = bus.try_lease("probe", "node-b", 0.2)
+    time.sleep(0.25)
+    after_expiry = bus.try_lease("probe", "node-b", 0.2)
+    checks.append(("Lease exclusive, then taken over after TTL", (first, second, after_expiry) == ("node-a", "node-a", "node-b")))
+
+    # 2. A single node elects itself leader
+    checks.append(("Lone node is leader", cluster.is_leader()))
+
+    # 3. Ticket created on a peer shows up in the pending store and queue
+    created_at = datetime.utcnow()
+    peer_event(
+        bus, cluster.TICKET_CREATED, ticket_id="t-1", tenant_id=TENANT, caller="Ann",
+        question="Gift cards?", created_at=created_at.isoformat(), room_url=None,
+    )
+    ticket = pending_store.get("t-1")
+    checks.append(("Peer ticket mirrored", ticket is not None and ticket.caller == "Ann" and ticket.created_at == created_at))
+    checks.append(("Peer ticket queued", scheduler.scheduler_stats(TENANT)["queued"] == 1))
+
+    # 4. A room-ready signal from the peer wakes a local join_token waiter
+    waiter = asyncio.create_task(cluster.wait_for_room("t-1", timeout=2.0))
+    await asyncio.sleep(0.05)
+    peer_event(bus, cluster.ROOM_READY, ticket_id="t-1", room_url="support-t-1")
+    start = time.monotonic()
+    room = await waiter
+    checks.append(("Room-ready signal wakes waiter", room == "support-t-1" and time.monotonic() - start < 0.5))
+
+    # 5. Our own events aren't applied twice
+    received = cluster.cluster_stats()["received"]
+    cluster.room_ready("t-1", "support-t-1")
+    checks.append(("Own events ignored", cluster.cluster_stats()["received"] == received))
+
+    # 6. A claim held by a peer's supervisor wins over a local claim
+    bus.try_lease("ticket:t-1", "sup-b", 5)
+    owner = scheduler.claim("t-1", "sup-a", TENANT)
+    checks.append(("Claim arbitrated cluster-wide", owner == "sup-b"))
+
+    # 7. Closing on the peer removes the ticket everywhere
+    peer_event(bus, cluster.TICKET_CLOSED, ticket_id="t-1", tenant_id=TENANT)
+    checks.append(("Peer close mirrored", pending_store.get("t-1") is None and not scheduler.assignments(TENANT)))
+
+    # 8. Losing the leader lease stops local dispatch; assignments come from the leader
+    bus.release_lease(cluster.LEADER_LEASE, "node-a")
+    bus.try_lease(cluster.LEADER_LEASE, "node-b", 0.3)
+    cluster._renew_leadership()
+    scheduler.heartbeat("sup-a", TENANT)
+    scheduler.enqueue("t-2", datetime.utcnow(), TENANT)
+    idle_follower = not cluster.is_leader() and "t-2" not in scheduler.assignments(TENANT)
+    peer_event(bus, cluster.TICKET_ASSIGNED, ticket_id="t-2", supervisor_id="sup-b", tenant_id=TENANT)
+    checks.append(("Follower mirrors leader's assignment", idle_follower and scheduler.assignments(TENANT).get("t-2") == "sup-b"))
+
+    # 9. When the leader's lease lapses this node takes over and dispatches
+    scheduler.enqueue("t-3", datetime.utcnow(), TENANT)
+    time.sleep(0.35)
+    cluster._renew_leadership()
+    checks.append(("Failover: new leader dispatches", cluster.is_leader() and scheduler.assignments(TENANT).get("t-3") == "sup-a"))
+
+    # 10. The bus interface can't be half-implemented
+    try:
+        MessageBus()
+        abstract = False
+    except TypeError:
+        abstract = True
+    checks.append(("MessageBus is abstract", abstract))
+
+    # 11. A caller's allowance is shared: node-b's escalations use up node-a's tokens
+    for _ in range(CALLER_BUCKET_CAPACITY - 1):
+        bus.take_token("caller:shared", CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND)
+    last = cluster.take_token("caller:shared", CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND)
+    over = cluster.take_token("caller:shared", CALLER_BUCKET_CAPACITY, CALLER_REFILL_PER_SECOND)
+    checks.append(("Per-caller bucket shared across nodes", last and not over))
+
+    # 12. A retry whose first attempt ran on node-b replays node-b's result
+    bus.try_lease("idem:t:call:r-1", "node-b-attempt", 60)
+    bus.put("idem-result:t:call:r-1", json.dumps(["from-node-b", 200]), 60)
+    ran_locally = []
+
+    async def escalate():
+        ran_locally.append(True)
+        return ["from-node-a", 200]
+
+    replay = await run_once("t:call:r-1", escalate)
+    checks.append(("Idempotency key deduplicated cluster-wide", replay == ["from-node-b", 200] and not ran_locally))
+
+    # 13. Analytics deltas from node-b count in this node's stats; local events are batched, not sent one by one
+    timeouts = analytics.stats()["totals"]["timeouts"]
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0).isoformat()
+    peer_event(bus, cluster.ANALYTICS_DELTA, counters={hour: {"timeouts": 2}}, questions={"gift cards?": 2})
+    for _ in range(50):
+        analytics.record_kb_lookup(True)
+    delta = analytics.take_unsent()
+    checks.append((
+        "Peer analytics replicated, local ones batched",
+        analytics.stats()["totals"]["timeouts"] == timeouts + 2
+        and delta is not None and sum(c.get("kb_hits", 0) for c in delta["counters"].values()) == 50,
+    ))
+
+    # 14. A missed ticket.closed is repaired by the periodic resync from the DB
+    pending_store.add(PendingTicket("t-ghost", TENANT, "Bo", "Hours?", datetime.utcnow() - timedelta(hours=1)))
+    scheduler.enqueue("t-ghost", datetime.utcnow() - timedelta(hours=1), TENANT)
+    cluster.resync_pending()
+    checks.append(("Resync drops tickets closed elsewhere", pending_store.get("t-ghost") is None))
+
+    # 15. A bus outage during dispatch doesn't strand the ticket between queued and assigned
+    scheduler.heartbeat("sup-c", TENANT)
+    real_try_lease = bus.try_lease
+
+    def broken_try_lease(*args):
+        raise ConnectionError("bus down")
+
+    bus.try_lease = broken_try_lease
+    try:
+        scheduler.enqueue("t-4", datetime.utcnow(), TENANT)
+        cluster.heartbeat("sup-c", TENANT)
+        survived = "t-4" in scheduler.assignments(TENANT)
+    except Exception:
+        survived = False
+    finally:
+        bus.try_lease = real_try_lease
+    checks.append(("Bus outage: dispatch falls back to local assignment", survived))
+
+    # 16. Dispatch reserves outside the scheduler lock; a lost reservation is handed to the owner
+    bus.try_lease("ticket:t-5", "sup-b", 5)
+    scheduler.heartbeat("sup-d", TENANT)
+    scheduler.enqueue("t-5", datetime.utcnow(), TENANT)
+    await asyncio.sleep(0.1)  # Confirmation runs on the scheduler's worker thread
+    checks.append(("Dispatch defers to a claim won elsewhere", scheduler.assignments(TENANT).get("t-5") == "sup-b"))
+
+    print(f"\nCluster stats: {cluster.cluster_stats()}")
+    cluster.stop()
+
+    print("\n" + "=" * 60)
+    all_passed = True
+    for check_name, passed in checks:
+        print(f"{'✓' if passed else '✗'} {check_name}")
+        all_passed = all_passed and passed
+    print("=" * 60)
+    print("✅ ALL CHECKS PASSED!" if all_passed else "❌ SOME CHECKS FAILED!")
+    return all_passed
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,125 @@
+"""
+Fault-injection check for the LiveKit client wrapper.
+Runs a local stub of the LiveKit RoomService and drives it through slow,
+failing and already-exists responses; no LiveKit account needed.
+Run: python -m app.test_livekit_faults
+"""
+import asyncio
+import time
+from aiohttp import web
+from livekit.api import Room
+from app.livekit_client import CircuitBreaker, LiveKitClient, LiveKitUnavailable
+
+CREATE_ROOM_PATH = "/twirp/livekit.RoomService/CreateRoom"
+
+# What the stub does with the next CreateRoom call: ok | slow | error | exists
+mode = {"value": "ok", "hits": 0}
+
+
+async def create_room_stub(request: web.Request) -> web.Response:
+    mode["hits"] += 1
+    if mode["value"] == "slow":
+        await asyncio.sleep(2)
+    if mode["value"] == "error":
+        return web.json_response({"code": "internal", "msg": "injected failure"}, status=500)
+    if mode["value"] == "exists":
+        return web.json_response({"code": "already_exists", "msg": "room exists"}, status=409)
+    return web.Response(body=Room(name="stub-room").SerializeToString(), content_type="application/protobuf")
+
+
+async def main():
+    app = web.Application()
+    app.router.add_post(CREATE_ROOM_PATH, create_room_stub)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    client = LiveKitClient(
+        f"http://127.0.0.1:{port}", "devkey", "devsecret-devsecret-devsecret-00",
+        timeout=0.5,
+        breaker=CircuitBreaker(failure_threshold=3, reset_seconds=1.0),
+    )
+    checks = []
+
+    print("=" * 60)
+    print("LIVEKIT FAULT INJECTION")
+    print("=" * 60)
+
+    # 1. Healthy call
+    mode["value"] = "ok"
+    checks.append(("Healthy create_room returns room name", await client.create_room("r1") == "stub-room"))
+
+    # 2. Already exists is success, not an error
+    mode["value"] = "exists"
+    checks.append(("already_exists treated as success", await client.create_room("r2") == "r2"))
+
+    # 3. Slow LiveKit hits the deadline instead of hanging
+    mode["value"] = "slow"
+    start = time.monotonic()
+    try:
+        await client.create_room("r3")
+        timed_out = False
+    except LiveKitUnavailable:
+        timed_out = True
+    checks.append(("Slow call fails at the deadline", timed_out and time.monotonic() - start < 1.5))
+
+    # 4. Server errors surface as LiveKitUnavailable and open the breaker
+    mode["value"] = "error"
+    for _ in range(2):
+        try:
+            await client.create_room("r4")
+        except LiveKitUnavailable:
+            pass
+    checks.append(("Breaker opens after repeated failures", client.breaker.state == CircuitBreaker.OPEN))
+
+    # 5. Open breaker fails fast without touching the stub
+    hits_before = mode["hits"]
+    start = time.monotonic()
+    try:
+        await client.create_room("r5")
+        rejected = False
+    except LiveKitUnavailable:
+        rejected = True
+    checks.append(("Open breaker fails fast", rejected and mode["hits"] == hits_before and time.monotonic() - start < 0.05))
+
+    # 6. After the reset window a successful trial closes the breaker
+    await asyncio.sleep(1.1)
+    mode["value"] = "ok"
+    await client.create_room("r6")
+    checks.append(("Half-open trial closes breaker", client.breaker.state == CircuitBreaker.CLOSED))
+
+    # 7. Bounded concurrency: calls beyond the limit queue, they don't pile onto LiveKit
+    limited = LiveKitClient(
+        f"http://127.0.0.1:{port}", "devkey", "devsecret-devsecret-devsecret-00",
+        timeout=5, max_concurrency=2,
+    )
+    in_flight = {"now": 0, "max": 0}
+
+    async def tracked(lk):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+
+    await asyncio.gather(*[limited.call("probe", tracked) for _ in range(6)])
+    checks.append(("Concurrency limited to 2", in_flight["max"] == 2))
+
+    print(f"\nClient stats: {client.stats()}")
+    await client.close()
+    await limited.close()
+    await runner.cleanup()
+
+    print("\n" + "=" * 60)
+    all_passed = True
+    for check_name, passed in checks:
+        print(f"{'✓' if passed else '✗'} {check_name}")
+        all_passed = all_passed and passed
+    print("=" * 60)
+    print("✅ ALL CHECKS PASSED!" if all_passed else "❌ SOME CHECKS FAILED!")
+    return all_passed
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if asyncio.run(main()) else 1)
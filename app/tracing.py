@@ -0,0 +1,302 @@
+"""
+Opt-in request tracing for the escalation path.
+Spans nest through a context variable, so they follow the request across
+awaits and into DB calls. Finished spans are kept in a local ring buffer for
+/admin/traces and, with TRACING_FILE set, written by a background thread as
+OTLP/JSON: one ExportTraceServiceRequest (resourceSpans > scopeSpans > spans)
+per line, which the OpenTelemetry collector's otlpjsonfile receiver reads.
+Enable with TRACING_ENABLED=1. When disabled a span costs one flag check.
+"""
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TRACE_BUFFER_SPANS = 5000
+TRACE_FLUSH_SECONDS = 1.0
+MAX_STATEMENT_CHARS = 200
+SERVICE_NAME = "ai-helpdesk"
+
+# OTLP enum values (OTLP/JSON encodes enums as integers)
+SPAN_KIND_INTERNAL = 1
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+_enabled = False
+_file_path: Optional[str] = None
+_lock = threading.Lock()
+_finished: deque = deque(maxlen=TRACE_BUFFER_SPANS)
+_unwritten: deque = deque(maxlen=TRACE_BUFFER_SPANS)  # Waiting for the file writer; oldest dropped if it falls behind
+_flush_thread: Optional[threading.Thread] = None
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        _export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        """The span in OTLP/JSON form."""
+        record = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": STATUS_CODE_ERROR, "message": self.error} if self.error else {"code": STATUS_CODE_OK},
+        }
+        if self.parent_span_id:
+            record["parentSpanId"] = self.parent_span_id
+        return record
+
+
+def _otlp_value(value) -> dict:
+    # bool before int: bool is an int subclass. 64-bit ints are strings in OTLP/JSON.
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_request(spans) -> dict:
+    """Wrap spans in an OTLP ExportTraceServiceRequest envelope."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [span.to_dict() for span in spans],
+            }],
+        }],
+    }
+
+
+def _export(span: Span):
+    # Hot path: no serialization or I/O here; the flush thread writes the file
+    with _lock:
+        _finished.append(span)
+        if _file_path:
+            _unwritten.append(span)
+
+
+def flush():
+    """Write buffered spans to TRACING_FILE as one OTLP/JSON line."""
+    with _lock:
+        batch = list(_unwritten)
+        _unwritten.clear()
+        path = _file_path
+    if batch and path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(otlp_request(batch)) + "\n")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(TRACE_FLUSH_SECONDS)
+        try:
+            flush()
+        except OSError as e:
+            print(f"[Tracing] Could not write {_file_path}: {e}")
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """Start a span under the current one without making it current (for leaf spans). None when disabled."""
+    if not _enabled:
+        return None
+    return Span(name, _current.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Trace the enclosed block; nested spans and DB statements become its children."""
+    if not _enabled:
+        yield None
+        return
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.end(exc)
+        raise
+    else:
+        current.end()
+    finally:
+        _current.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span() for plain and async functions."""
+    def decorate(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TracingMiddleware:
+    """
+    Plain ASGI middleware opening a root span per HTTP request; escalation and
+    DB spans nest under it. With tracing off, requests go straight through.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not _enabled:
+            await self.app(scope, receive, send)
+            return
+        method, path = scope["method"], scope["path"]
+        with span(f"{method} {path}", **{"http.method": method, "http.target": path}) as root:
+
+            async def send_traced(message: Message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_traced)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    root.name = f"{method} {route.path}"  # Group /join_token/{ticket_id} etc.
+
+
+# --- DB statements ---
+def instrument_engine(engine):
+    """Record every SQL statement run through engine as a db.query span."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = start_span(
+            "db.query", **{"db.system": engine.dialect.name, "db.statement": statement[:MAX_STATEMENT_CHARS]}
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_span = getattr(context, "_trace_span", None)
+        if db_span is not None:
+            db_span.set_attribute("db.rowcount", cursor.rowcount)
+            db_span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        db_span = getattr(exception_context.execution_context, "_trace_span", None)
+        if db_span is not None:
+            db_span.end(exception_context.original_exception)
+
+
+def configure():
+    """Read TRACING_ENABLED / TRACING_FILE (called at startup, after .env is loaded)."""
+    global _enabled, _file_path, _flush_thread
+    _enabled = os.getenv("TRACING_ENABLED", "").lower() in ("1", "true", "yes")
+    _file_path = os.getenv("TRACING_FILE") or None
+    if _file_path and _flush_thread is None:
+        _flush_thread = threading.Thread(target=_flush_loop, name="trace-flush", daemon=True)
+        _flush_thread.start()
+    if _enabled:
+        print(f"[Tracing] ✓ Spans enabled{f', exporting to {_file_path}' if _file_path else ''}")
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+# --- Reporting ---
+def recent_traces(limit: int = 20) -> list[dict]:
+    """The latest traces, newest first, each with its spans (OTLP/JSON form) in start order."""
+    with _lock:
+        finished = list(_finished)
+    traces: dict[str, list[Span]] = {}
+    for s in finished:
+        traces.setdefault(s.trace_id, []).append(s)
+
+    result = []
+    for trace_id, spans in traces.items():
+        spans.sort(key=lambda s: s.start_ns)
+        ids = {s.span_id for s in spans}
+        root = next((s for s in spans if s.parent_span_id not in ids), spans[0])
+        result.append({
+            "trace_id": trace_id,
+            "root": root.name,
+            "start_unix_nano": root.start_ns,
+            "duration_ms": round(root.duration_ms, 3),
+            "spans": [{**s.to_dict(), "durationMs": round(s.duration_ms, 3)} for s in spans],
+        })
+    result.sort(key=lambda t: t["start_unix_nano"], reverse=True)
+    return result[:limit]
+
+
+def span_summary() -> dict:
+    """Per span name: count, mean, p95 and max duration (ms) over the buffered spans."""
+    with _lock:
+        finished = list(_finished)
+    durations: dict[str, list[float]] = {}
+    for s in finished:
+        durations.setdefault(s.name, []).append(s.duration_ms)
+
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "mean_ms": round(sum(values) / len(values), 3),
+            "p95_ms": round(values[min(len(values) - 1, int(0.95 * len(values)))], 3),
+            "max_ms": round(values[-1], 3),
+        }
+    return summary